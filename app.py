@@ -1,5 +1,4 @@
 import os
-import duckdb
 import faicons as fa
 from dotenv import load_dotenv
 from pathlib import Path
@@ -7,7 +6,11 @@ from chatlas import ChatGoogle, ChatOpenAI
 from shiny import App, ui, render, reactive
 
 import query
-from shared import tips
+from dashboard import LazyResult, summary_sql
+from db import materialize, pool, query_df, shape_result
+from grid import lazy_grid_server, lazy_grid_ui
+from history import compact_history
+from shared import data_version, tips
 
 here = Path(__file__).parent
 icon_ellipsis = fa.icon_svg("ellipsis")
@@ -91,7 +94,7 @@ app_ui = ui.page_fluid(
 					# 🔍 Data table
 					ui.card(
 							ui.card_header("Tips data"),
-							ui.output_data_frame("table"),
+							lazy_grid_ui("table", list(tips.columns)),
 							full_screen=False,
 					), 
 					            
@@ -106,67 +109,23 @@ def server(input, output, session):
 
 	current_query = reactive.Value("")
 	current_title = reactive.Value("")
+
+	@reactive.calc
+	async def tips_data():
+		sql = current_query()
+		if sql == "":
+			return LazyResult(sql, frame=tips)
+		# Usually already materialized (and cached) by update_dashboard
+		return LazyResult(sql, await pool.run(lambda cur: materialize(cur, sql)))
 	
-	# Store conversation history as a list of message dictionaries
-	conversation_history = reactive.value([])
+	# The session's chat client and the model it talks to. It persists across
+	# messages so turns are appended natively and the system prompt stays the
+	# same (and cacheable by the provider) for the whole conversation.
+	chat_client = reactive.value(None)
 	
 	def create_chat_client(model_name):
 		"""Create a fresh chat client for the specified model"""
-		if model_name == "gemini-2.0-flash":
-			client = ChatGoogle(
-				api_key=os.environ.get("GOOGLE_API_KEY"),
-				system_prompt="""
-				You are a helpful chatbot that can analyze data and answer questions.
-				Previous conversation context will be provided to maintain continuity.
-				""",
-				model="gemini-2.0-flash-exp",
-			)
-		else:  # gpt-4o-mini
-			client = ChatOpenAI(
-				api_key=os.environ.get("OPENAI_API_KEY"),
-				system_prompt="""
-				You are a helpful chatbot that can analyze data and answer questions.
-				Previous conversation context will be provided to maintain continuity.
-				""",
-				model="gpt-4o-mini",
-			)
-		client.register_tool(update_dashboard)
-		client.register_tool(query_db)
-		return client	
-
-	def get_chat_client_with_history(model_name):
-		"""Get chat client and provide conversation history as context"""
-		# Build context from conversation history
-		history = conversation_history.get()
-		context_messages = []
-		
-		if history:
-			# Convert history to context string
-			context_parts = []
-			for msg in history:
-				if msg["role"] == "user":
-					context_parts.append(f"User: {msg['content']}")
-				else:  # assistant
-					model_used = msg.get("model", "Assistant")
-					context_parts.append(f"{model_used}: {msg['content']}")
-			
-			conversation_context = "\n\n".join(context_parts)
-		else:
-				conversation_context = ""
-		
-
-		
-
-		# Create chat client with enhanced system prompt including context
-		system_prompt = query.system_prompt(tips, "tips")
-		
-		if conversation_context:
-			system_prompt += f"""
-		Here is the previous conversation context to maintain continuity:
-		
-		{conversation_context}
-		"""
-		
+		system_prompt = query.system_prompt(tips, "tips", version=data_version)
 		if model_name == "gemini-2.0-flash":
 			client = ChatGoogle(
 				api_key=os.environ.get("GOOGLE_API_KEY"),
@@ -182,17 +141,24 @@ def server(input, output, session):
 		client.register_tool(update_dashboard)
 		client.register_tool(query_db)
 		return client	
+
+	def get_chat_client(model_name):
+		"""Get the session's chat client for the model, switching clients (and
+		carrying the conversation over) only when the model changes"""
+		current = chat_client.get()
+		if current is not None and current[0] == model_name:
+			return current[1]
+		
+		client = create_chat_client(model_name)
+		if current is not None:
+			client.set_turns(current[1].get_turns())
+		chat_client.set((model_name, client))
+		return client
 	
 	chat = ui.Chat(id="chat")
 
 
 		
-	@reactive.calc
-	def tips_data():
-		if current_query() == "":
-			return tips
-		return duckdb.query(current_query()).df()
-	
 	@render.text
 	def show_title():
 		return current_title()
@@ -202,59 +168,49 @@ def server(input, output, session):
 		return current_query()
 	
 	# 🎯 Value box outputs -----------------------------------------------------
+	@reactive.calc
+	async def summary():
+		# All three value boxes come from one small aggregate, so the rows never
+		# need to be converted to pandas for them
+		data = await tips_data()
+		# As a dict, so the count isn't upcast to float along with the averages
+		return (await data.query(summary_sql(data.source))).to_dict("records")[0]
+
 	@render.text
-	def total_tippers():
-		return str(tips_data().shape[0])
-	
+	async def total_tippers():
+		return str((await summary())["tippers"])
+
 	@render.text
-	def average_tip():
-		d = tips_data()
-		if d.shape[0] > 0:
-			perc = d.tip / d.total_bill
-			return f"{perc.mean():.1%}"
+	async def average_tip():
+		s = await summary()
+		if s["tippers"] > 0:
+			return f"{s['average_tip']:.1%}"
 
 	@render.text
-	def average_bill():
-		d = tips_data()
-		if d.shape[0] > 0:
-			return f"${d.total_bill.mean():.2f}"
+	async def average_bill():
+		s = await summary()
+		if s["tippers"] > 0:
+			return f"${s['average_bill']:.2f}"
 		
 
 	# 🔍 Data table ------------------------------------------------------------
-	@render.data_frame
-	def table():
-		return render.DataGrid(tips_data())
+	lazy_grid_server("table", tips_data)
 
 	@chat.on_user_submit
 	async def handle_user_input(user_input: str):
 		try:
 			current_model = input.model()
 			
-			# Add user message to conversation history
-			history = conversation_history.get().copy()
-			history.append({"role": "user", "content": user_input})
-			conversation_history.set(history)
-			
-			# Get chat client with full conversation history
-			chat_client = get_chat_client_with_history(current_model)
-
-			
-			
-			# Get response from the model (it now has full context)
-			response_stream = await chat_client.stream_async(user_input)
-			full_response = ""
-			
-			# Collect the full response
-			async for chunk in response_stream:
-					full_response += chunk
-			
-			# Add assistant response to conversation history
-			history = conversation_history.get().copy()
-			history.append({"role": "assistant", "content": full_response, "model": current_model})
-			conversation_history.set(history)
+			# The client already holds the earlier turns of the conversation
+			client = get_chat_client(current_model)
+			# Drop old query results (and, if needed, old exchanges) so the
+			# history sent with every request stays bounded
+			compact_history(client)
+			response_stream = await client.stream_async(user_input)
 			
-			# Display response in chat UI
-			await chat.append_message(full_response)
+			# Display the response in the chat UI as it is generated. The client
+			# records the finished turn itself, so nothing needs to be collected
+			await chat.append_message_stream(response_stream)
 				
 		except Exception as e:
 			error_msg = f"Error with {input.model()}: {str(e)}"
@@ -279,18 +235,22 @@ def server(input, output, session):
 				query: A DuckDB SQL query; must be a SELECT statement, or an empty string to reset the dashboard.
 				title: A title to display at the top of the data dashboard, summarizing the intent of the SQL query.
   	""" 			 
-		# Verify that the query is OK; throws if not
+		# Verify that the query is OK; throws if not. It is run in full, so
+		# run-time errors surface too, and the result is cached for tips_data()
+		# to reuse rather than run the query again.
 		if query != "":
-			await query_db(query)
+			await pool.run(lambda cur: materialize(cur, query))
 			await update_filter(query, title)
 
 	async def query_db(query: str):
-		"""Perform a SQL query on the data, and return the results as JSON.
+		"""Perform a SQL query on the data, and return the results as JSON. Large results are truncated to a summary.
 
 		Args:
 			query: A DuckDB SQL query; must be a SELECT statement.
 		"""
-		return duckdb.query(query).to_df().to_json(orient="records")
+		return await pool.run(
+			lambda cur: shape_result(query_df(cur, query))
+		)
 
 	
 
@@ -306,7 +266,7 @@ def server(input, output, session):
     # @reactive.effect
     # @reactive.event(input.clear_history)
     # def clear_conversation():
-    #     conversation_history.set([])
+    #     chat_client.set(None)
     #     print("Conversation history cleared")
     
 	
@@ -0,0 +1,85 @@
+"""Cost of one dashboard filter change: re-running the query per output vs.
+materializing it once.
+
+"rerun" is the previous behaviour: update_dashboard validates the query by
+counting its rows, then every output (value boxes, gender chart, scatter
+plot and trendline, grid page) wraps the query as a subquery and runs it
+again. "materialize" validates with db.materialize, and the outputs query
+the resulting Arrow table. Timed on ROWS synthetic rows, for a plain filter
+and for one with a window function, as the model often writes.
+
+    python benchmarks/bench_dashboard_refresh.py
+"""
+
+import asyncio
+
+import common
+import dashboard
+import db
+import duckdb
+import grid
+from bench_duckdb_modes import synthetic_tips
+from dashboard import AggregateChart, LazyResult, scatter_figure, summary_sql
+
+ROWS = [1_000_000]
+QUERIES = {
+    "filter": "SELECT * FROM tips WHERE day IN ('Sat', 'Sun') AND total_bill > 20",
+    "window": """
+        SELECT *, tip - avg(tip) OVER (PARTITION BY day, size) AS tip_vs_table_size
+        FROM tips WHERE total_bill > 10
+    """,
+}
+
+gender = AggregateChart(
+    group_by="sex", measures={"total_bill": "avg(total_bill)", "tip": "avg(tip)"}
+)
+
+
+async def refresh(pool: db.CursorPool, sql: str, materialize: bool) -> None:
+    # A new filter: nothing is cached yet
+    db.result_cache.clear()
+    db.dashboard_results.clear()
+    if materialize:
+        await pool.run(lambda cur: db.materialize(cur, sql))  # update_dashboard
+        data = LazyResult(sql, await pool.run(lambda cur: db.materialize(cur, sql)))
+    else:
+        count = f"SELECT count(hash(current)) AS n FROM {db.query_source(sql)} AS current"
+        await pool.run(lambda cur: db.query_df(cur, count))
+        data = LazyResult(sql)
+
+    async def grid_page():
+        sql = grid.page_sql(data.source, 0, 100, sort_by="tip", columns=await data.columns())
+        await data.run(sql)
+
+    await asyncio.gather(
+        data.query(summary_sql(data.source)),
+        gender.figure(data),
+        scatter_figure(data, "day"),
+        data.row_count(),
+        grid_page(),
+    )
+
+
+def main():
+    for rows in ROWS:
+        con = duckdb.connect()
+        con.register("tips_frame", synthetic_tips(rows))
+        con.execute("CREATE TABLE tips AS SELECT * FROM tips_frame")
+        con.unregister("tips_frame")
+        pool = db.CursorPool(con, db.POOL_SIZE)
+        # The outputs run on the module's pool
+        dashboard.pool = pool
+        for name, sql in QUERIES.items():
+            times = {
+                mode: common.timed(lambda: asyncio.run(refresh(pool, sql, mode == "materialize")), repeat=3)
+                for mode in ["rerun", "materialize"]
+            }
+            print(
+                f"{rows:>10,} rows  {name:<7} rerun {times['rerun']:6.2f}s  "
+                f"materialize {times['materialize']:6.2f}s  ({times['rerun'] / times['materialize']:.1f}x)"
+            )
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
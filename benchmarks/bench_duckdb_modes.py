@@ -0,0 +1,78 @@
+"""Dashboard queries over a registered pandas frame vs. a native DuckDB file.
+
+"frame" is the original setup, with `tips` a view over a pandas DataFrame;
+"file" materializes it into a .duckdb file (as TIPS_DUCKDB_PATH does) and
+attaches that read-only. Both are timed on ROWS synthetic rows.
+
+    python benchmarks/bench_duckdb_modes.py
+"""
+
+import tempfile
+from pathlib import Path
+
+import common
+import duckdb
+import numpy as np
+import pandas as pd
+import shared
+from dashboard import AggregateChart, summary_sql, trend_sql
+from db import query_source
+
+ROWS = [1_000_000, 5_000_000]
+FILTER = "SELECT * FROM tips WHERE day IN ('Sat', 'Sun') AND total_bill > 20"
+
+gender = AggregateChart(
+    group_by="sex", measures={"total_bill": "avg(total_bill)", "tip": "avg(tip)"}
+)
+QUERIES = {
+    "value boxes": summary_sql(query_source(FILTER)),
+    "gender chart": gender.sql(query_source(FILTER)),
+    "trendline bins": trend_sql(query_source(FILTER), "day"),
+    "sorted grid page": f"SELECT * FROM {query_source(FILTER)} AS current ORDER BY tip DESC LIMIT 100",
+    "row count": f"SELECT count(*) FROM {query_source(FILTER)} AS current",
+}
+
+
+def synthetic_tips(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(42)
+    total_bill = rng.uniform(3, 50, rows).round(2)
+    df = pd.DataFrame(
+        {
+            "id": np.arange(1, rows + 1),
+            "total_bill": total_bill,
+            "tip": (total_bill * rng.uniform(0.05, 0.3, rows)).round(2),
+            "sex": rng.choice(["Female", "Male"], rows),
+            "smoker": rng.choice(["No", "Yes"], rows),
+            "day": rng.choice(["Thur", "Fri", "Sat", "Sun"], rows),
+            "time": rng.choice(["Dinner", "Lunch"], rows),
+            "size": rng.integers(1, 7, rows),
+        }
+    )
+    df = shared.normalize_schema(df)
+    df["percent"] = df.tip / df.total_bill
+    return df
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in ROWS:
+            df = synthetic_tips(rows)
+            frame = duckdb.connect()
+            frame.register("tips", df)
+
+            path = Path(tmp) / f"tips_{rows}.duckdb"
+            shared.materialize_table(path, "tips", df)
+            native = duckdb.connect()
+            native.execute(f"ATTACH '{path}' AS tips_db (READ_ONLY)")
+            native.execute("CREATE VIEW tips AS SELECT * FROM tips_db.tips")
+
+            print(f"\n{rows:,} rows (best of 5, ms)")
+            print(f"{'query':>18} {'frame':>8} {'file':>8} {'speedup':>8}")
+            for name, sql in QUERIES.items():
+                a = common.timed(lambda: frame.execute(sql).fetchall(), repeat=5)
+                b = common.timed(lambda: native.execute(sql).fetchall(), repeat=5)
+                print(f"{name:>18} {a * 1000:>8.1f} {b * 1000:>8.1f} {a / b:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
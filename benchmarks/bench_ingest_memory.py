@@ -0,0 +1,71 @@
+"""Peak memory of building the tips DataFrame, page by page vs. list of dicts.
+
+Each measurement runs in a fresh process and reports how far its peak RSS
+grew while loading ROWS synthetic rows from an in-process Supabase stand-in:
+
+- "dicts": the original approach, collecting every row dict and then
+  calling pd.DataFrame on the whole list
+- "pages": shared.fetch_table, converting each page to typed columns
+  (with categoricals) as it arrives
+
+    python benchmarks/bench_ingest_memory.py
+"""
+
+import resource
+import subprocess
+import sys
+
+import common
+import pandas as pd
+import shared
+from fake_supabase import FakeSupabase
+
+ROWS = [100_000, 1_000_000]
+
+
+def fetch_table_dicts(table: str) -> pd.DataFrame:
+    all_data = []
+    start = 0
+    while True:
+        page = shared.fetch_page(table, start, start + shared.PAGE_SIZE - 1)
+        all_data.extend(page)
+        if len(page) < shared.PAGE_SIZE:
+            break
+        start += shared.PAGE_SIZE
+    return pd.DataFrame(all_data)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(method: str, rows: int) -> None:
+    shared.supabase = FakeSupabase(rows)
+    load = fetch_table_dicts if method == "dicts" else shared.fetch_table
+    before = peak_rss_mb()
+    df = load("tips")
+    growth = peak_rss_mb() - before
+    size = df.memory_usage(deep=True).sum() / 1024**2
+    print(f"{growth:.0f} {size:.0f}")
+
+
+def main():
+    print(f"{'rows':>9} {'method':>6} {'peak RSS growth':>16} {'frame size':>11}")
+    for rows in ROWS:
+        for method in ["dicts", "pages"]:
+            out = subprocess.run(
+                [sys.executable, __file__, method, str(rows)],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.split()
+            growth, size = (float(x) for x in out[-2:])
+            print(f"{rows:>9} {method:>6} {growth:>13.0f} MB {size:>8.0f} MB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        measure(sys.argv[1], int(sys.argv[2]))
+    else:
+        main()
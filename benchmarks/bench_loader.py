@@ -0,0 +1,36 @@
+"""Serial vs concurrent page fetching in shared.fetch_table.
+
+Runs the loader against an in-process Supabase stand-in that sleeps for
+LATENCY seconds per request, with one worker (one request at a time, as the
+original loop did) and with the default LOAD_WORKERS.
+
+    python benchmarks/bench_loader.py
+"""
+
+import common
+import shared
+from fake_supabase import FakeSupabase
+
+LATENCY = 0.05
+ROWS = [10_000, 50_000]
+
+
+def main():
+    print(f"Per-request latency: {LATENCY * 1000:.0f} ms")
+    print(f"{'rows':>8} {'requests':>9} {'serial':>9} {'concurrent':>11} {'speedup':>8}")
+    workers = shared.LOAD_WORKERS
+    for rows in ROWS:
+        shared.supabase = FakeSupabase(rows, latency=LATENCY)
+        shared.LOAD_WORKERS = 1
+        serial = common.timed(lambda: shared.fetch_table("tips"))
+        requests = shared.supabase.requests
+        shared.LOAD_WORKERS = workers
+        concurrent = common.timed(lambda: shared.fetch_table("tips"))
+        print(
+            f"{rows:>8} {requests:>9} {serial:>8.2f}s {concurrent:>10.2f}s "
+            f"{serial / concurrent:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Profiling a frame for the system prompt: the original df_to_schema vs. now.
+
+The original ran nunique() and unique() over every TEXT column, and separate
+pandas min() and max() passes over every numeric one; profile_df stops at the
+categorical threshold and reduces numeric columns' arrays directly. Timed on
+ROWS synthetic tips rows.
+
+    python benchmarks/bench_profile.py
+"""
+
+import common
+import pandas as pd
+import query
+from bench_duckdb_modes import synthetic_tips
+
+ROWS = [1_000_000, 10_000_000]
+
+
+def original_df_to_schema(df: pd.DataFrame, name: str, categorical_threshold: int) -> str:
+    schema = [f"Table: {name}", "Columns:"]
+    for column, dtype in df.dtypes.items():
+        sql_type = query.sql_type(dtype)
+        schema.append(f"- {column} ({sql_type})")
+        if sql_type == "TEXT":
+            if df[column].nunique() <= categorical_threshold:
+                categories_str = ", ".join(f"'{cat}'" for cat in df[column].unique().tolist())
+                schema.append(f"  Categorical values: {categories_str}")
+        elif sql_type in ["INTEGER", "FLOAT"]:
+            schema.append(f"  Range: {df[column].min()} to {df[column].max()}")
+    return "\n".join(schema)
+
+
+def main():
+    for rows in ROWS:
+        df = synthetic_tips(rows)
+        # Plus a high-cardinality TEXT column, like a free-text field
+        df["note"] = "note " + (df.id % 100_000).astype(str)
+        assert original_df_to_schema(df, "tips", 10) == query.df_to_schema(df, "tips", 10)
+        before = common.timed(lambda: original_df_to_schema(df, "tips", 10), repeat=3)
+        after = common.timed(lambda: query.df_to_schema(df, "tips", 10), repeat=3)
+        print(f"{rows:>10,} rows  original {before:6.2f}s  profile_df {after:6.2f}s  ({before / after:.1f}x)")
+        del df
+
+
+if __name__ == "__main__":
+    main()
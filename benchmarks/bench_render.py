@@ -0,0 +1,102 @@
+"""Plot image rendering latency: cold vs. warm, inline vs. the render pool.
+
+"inline" is the original path, `to_image` on the event loop's thread, so
+the first render pays for starting Kaleido in the app process and every
+render stalls the loop. "pool" renders in explain_plot's worker processes.
+Cold is the first render after startup, warm the best of the next REPEAT.
+The longest event loop stall during each render is shown too.
+
+Needs Chrome for Kaleido; without it, renders fail fast and only process
+startup is measured, which is reported.
+
+    python benchmarks/bench_render.py
+"""
+
+import asyncio
+import subprocess
+import sys
+import time
+
+REPEAT = 5
+
+
+def figure_json() -> str:
+    import plotly.express as px
+    import shared
+
+    return px.scatter(shared.tips, x="total_bill", y="tip", color="day", trendline="lowess").to_json()
+
+
+async def stall_during(render) -> tuple[float, float, str | None]:
+    """Time `await render()`, and the longest gap of a ticker meanwhile."""
+    longest, done = 0.0, asyncio.Event()
+
+    async def ticker():
+        nonlocal longest
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            longest, last = max(longest, now - last), now
+
+    ticks = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    error = None
+    try:
+        await render()
+    except Exception as e:
+        error = type(e).__name__
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticks
+    return elapsed, longest, error
+
+
+async def inline_render(fig_json: str):
+    import explain_plot
+
+    explain_plot.render_image(fig_json, explain_plot.MODEL_IMAGE)
+
+
+async def pool_render(fig_json: str):
+    import explain_plot
+
+    await explain_plot.render_plot(fig_json, explain_plot.MODEL_IMAGE)
+
+
+def report(name: str, cold, warm) -> None:
+    errors = {r[2] for r in (cold, *warm) if r[2]}
+    best = min(warm)
+    print(
+        f"{name:<7} cold {cold[0]:6.2f}s (stall {cold[1]:5.2f}s)  "
+        f"warm {best[0]:6.2f}s (stall {max(r[1] for r in warm):5.2f}s)"
+        + (f"  [failed: {', '.join(sorted(errors))}]" if errors else "")
+    )
+
+
+async def main(mode: str):
+    # Imported here rather than at the top: the pool's workers are spawned,
+    # and re-import this script, which shouldn't load the data in each one
+    import common  # noqa: F401
+    import explain_plot
+
+    fig_json = figure_json()
+    render = inline_render if mode == "inline" else pool_render
+    if mode == "pool":
+        # As the apps do at startup, then a click as soon as they're up
+        explain_plot.render_pool()
+    cold = await stall_during(lambda: render(fig_json))
+    warm = [await stall_during(lambda: render(fig_json)) for _ in range(REPEAT)]
+    report(mode, cold, warm)
+    if mode == "pool":
+        explain_plot.discard_render_pool(explain_plot.render_pool())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        asyncio.run(main(sys.argv[1]))
+    else:
+        # A fresh interpreter per mode, so neither starts with Kaleido warm
+        for mode in ["inline", "pool"]:
+            subprocess.run([sys.executable, __file__, mode], check=True)
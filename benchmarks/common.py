@@ -0,0 +1,25 @@
+"""Shared setup for the benchmark scripts in this directory.
+
+Importing this module points shared.py at a local snapshot (see
+tests/conftest.py), so the benchmarks never need to reach Supabase, and
+makes the app modules and the test helpers importable.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+sys.path[:0] = [str(root), str(root / "tests")]
+
+import conftest  # noqa: E402,F401  Sets up the environment before shared.py is imported
+
+
+def timed(fn, repeat: int = 1) -> float:
+    """Best wall-clock time of `repeat` calls to `fn`, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
@@ -3,9 +3,7 @@ from pathlib import Path
 from typing import Annotated
 
 from dotenv import load_dotenv
-import duckdb
 import faicons as fa
-import plotly.express as px
 from chatlas import ChatOpenAI, ChatGoogle
 from shiny import App, reactive, render, ui
 from shinywidgets import output_widget, render_plotly
@@ -14,8 +12,12 @@ from ridgeplot import ridgeplot
 load_dotenv()
 
 import query
-from explain_plot import explain_plot
-from shared import tips  # Load data and compute static values
+from dashboard import AggregateChart, LazyResult, scatter_figure, summary_sql
+from db import materialize, pool, query_df, shape_result
+from explain_plot import explain_plot, render_pool
+from grid import lazy_grid_server, lazy_grid_ui
+from history import compact_history, fork_chat
+from shared import data_version, tips  # Load data and compute static values
 
 here = Path(__file__).parent
 
@@ -32,6 +34,13 @@ You can also say <span class="suggestion">Reset</span> to clear the current filt
 # Set to True to greatly enlarge chat UI (for presenting to a larger audience)
 DEMO_MODE = False
 
+gender_comparison = AggregateChart(
+    group_by="sex",
+    measures={"total_bill": "avg(total_bill)", "tip": "avg(tip)"},
+    title="Average Total Bill and Tip by Gender",
+    labels={"sex": "Gender", "value": "Average Amount", "variable": "Metric"},
+)
+
 icon_ellipsis = fa.icon_svg("ellipsis")
 icon_explain = ui.img(src="stars.svg")
 
@@ -172,7 +181,7 @@ app_ui = ui.page_fluid(
               # 🔍 Data table
       ui.card(
           ui.card_header("Tips data"),
-          ui.output_data_frame("table"),
+          lazy_grid_ui("table", list(tips.columns)),
           full_screen=False,
       ),
     ), id="tab"
@@ -189,10 +198,12 @@ def server(input, output, session):
     current_title = reactive.Value("")
 
     @reactive.calc
-    def tips_data():
-        if current_query() == "":
-            return tips
-        return duckdb.query(current_query()).df()
+    async def tips_data():
+        sql = current_query()
+        if sql == "":
+            return LazyResult(sql, frame=tips)
+        # Usually already materialized (and cached) by update_dashboard
+        return LazyResult(sql, await pool.run(lambda cur: materialize(cur, sql)))
 
     #
     # 🏷️ Header outputs --------------------------------------------------------
@@ -210,60 +221,50 @@ def server(input, output, session):
     # 🎯 Value box outputs -----------------------------------------------------
     #
 
+    @reactive.calc
+    async def summary():
+        # All three value boxes come from one small aggregate, so the rows never
+        # need to be converted to pandas for them
+        data = await tips_data()
+        # As a dict, so the count isn't upcast to float along with the averages
+        return (await data.query(summary_sql(data.source))).to_dict("records")[0]
+
     @render.text
-    def total_tippers():
-        return str(tips_data().shape[0])
+    async def total_tippers():
+        return str((await summary())["tippers"])
 
     @render.text
-    def average_tip():
-        d = tips_data()
-        if d.shape[0] > 0:
-            perc = d.tip / d.total_bill
-            return f"{perc.mean():.1%}"
+    async def average_tip():
+        s = await summary()
+        if s["tippers"] > 0:
+            return f"{s['average_tip']:.1%}"
 
     @render.text
-    def average_bill():
-        d = tips_data()
-        if d.shape[0] > 0:
-            bill = d.total_bill.mean()
-            return f"${bill:.2f}"
+    async def average_bill():
+        s = await summary()
+        if s["tippers"] > 0:
+            return f"${s['average_bill']:.2f}"
 
     #
     # 🔍 Data table ------------------------------------------------------------
     #
 
-    @render.data_frame
-    def table():
-        return render.DataGrid(tips_data())
+    lazy_grid_server("table", tips_data)
 
     # 📊 Gender comparison plot ------------------------------------------------
 
     @render_plotly
-    def gender_comparison_plot():
-        grouped_data = tips_data().groupby('sex')[['total_bill', 'tip']].mean().reset_index()
-        return px.bar(
-            grouped_data,
-            x="sex",
-            y=["total_bill", "tip"],
-            barmode="group",
-            labels={"sex": "Gender", "value": "Average Amount", "variable": "Metric"},
-            title="Average Total Bill and Tip by Gender"
-        )
+    async def gender_comparison_plot():
+        return await gender_comparison.figure(await tips_data())
 
     #
     # 📊 Scatter plot ----------------------------------------------------------
     #
 
     @render_plotly
-    def scatterplot():
+    async def scatterplot():
         color = input.scatter_color()
-        return px.scatter(
-            tips_data(),
-            x="total_bill",
-            y="tip",
-            color=None if color == "none" else color,
-            trendline="lowess",
-        )
+        return await scatter_figure(await tips_data(), None if color == "none" else color)
 
     @reactive.effect
     @reactive.event(input.interpret_scatter)
@@ -275,11 +276,11 @@ def server(input, output, session):
     #
 
     @render_plotly
-    def tip_perc():
+    async def tip_perc():
         # from ridgeplot import ridgeplot
 
-        dat = tips_data()
         yvar = input.tip_perc_y()
+        dat = await (await tips_data()).df([yvar, "percent"])
         uvals = dat[yvar].unique()
 
         samples = [[dat.percent[dat[yvar] == val]] for val in uvals]
@@ -327,7 +328,7 @@ def server(input, output, session):
                 chat_model = "gpt-4o-mini"
             
             session = Chat(
-                system_prompt=query.system_prompt(tips, "tips"), 
+                system_prompt=query.system_prompt(tips, "tips", version=data_version), 
                 model=chat_model
             )
             session.register_tool(update_dashboard)
@@ -350,19 +351,11 @@ def server(input, output, session):
         system prompt and model as the current one, and it has all the turns of the
         current session. The main reason to do this is to continue the conversation
         on a branch, without affecting the existing session.
-        TODO: chatlas Chat objects really should have a copy() method
 
         Returns:
             A new Chat object which is a fork of the current session.
         """
-        Chat, chat_model = get_current_model_info()
-        current_session = main_chat_session()
-        
-        new_session = Chat(system_prompt=current_session.system_prompt, model=chat_model)
-        new_session.register_tool(update_dashboard)
-        new_session.register_tool(query_db)
-        new_session.set_turns(current_session.get_turns())
-        return new_session
+        return fork_chat(main_chat_session())
 
     chat = ui.Chat("chat", messages=[greeting])
 
@@ -380,11 +373,15 @@ def server(input, output, session):
         # Create new session with the selected model
         Chat, chat_model = get_current_model_info()
         new_session = Chat(
-            system_prompt=query.system_prompt(tips, "tips"), 
+            system_prompt=query.system_prompt(tips, "tips", version=data_version), 
             model=chat_model
         )
-        new_session.register_tool(update_dashboard)
-        new_session.register_tool(query_db)
+        if current_session:
+            # Reuse the already-built tools rather than registering them again
+            new_session.set_tools(current_session.get_tools())
+        else:
+            new_session.register_tool(update_dashboard)
+            new_session.register_tool(query_db)
         
         # Transfer the conversation history to the new session
         if conversation_history:
@@ -400,6 +397,7 @@ def server(input, output, session):
     async def perform_chat(user_input: str):
         try:
             current_session = main_chat_session()
+            compact_history(current_session)
             stream = await current_session.stream_async(user_input, echo="all")
         except Exception as e:
             traceback.print_exc()
@@ -426,19 +424,26 @@ def server(input, output, session):
           title: A title to display at the top of the data dashboard, summarizing the intent of the SQL query.
         """
 
-        # Verify that the query is OK; throws if not
+        # Verify that the query is OK; throws if not. It is run in full, so
+        # run-time errors surface too, and the result is cached for tips_data()
+        # to reuse rather than run the query again.
         if query != "":
-            await query_db(query)
+            await pool.run(lambda cur: materialize(cur, query))
 
         await update_filter(query, title)
 
     async def query_db(query: str):
-        """Perform a SQL query on the data, and return the results as JSON.
+        """Perform a SQL query on the data, and return the results as JSON. Large results are truncated to a summary.
 
         Args:
           query: A DuckDB SQL query; must be a SELECT statement.
         """
-        return duckdb.query(query).to_df().to_json(orient="records")
+        return await pool.run(
+            lambda cur: shape_result(query_df(cur, query))
+        )
+
 
+app = App(app_ui, server, static_assets=here / "www")
 
-app = App(app_ui, server, static_assets=here / "www")
\ No newline at end of file
+# Start the plot render workers now, not on the first "explain" click
+render_pool()
\ No newline at end of file
@@ -0,0 +1,214 @@
+import asyncio
+from dataclasses import dataclass, field
+
+import duckdb
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import pyarrow as pa
+
+from db import pool, query_df, query_source
+
+
+def quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+# Name the materialized dashboard result is registered under, for the
+# outputs' queries over it
+RESULT_VIEW = "dashboard_result"
+
+
+class LazyResult:
+    """The result of the dashboard query, as the outputs query it.
+
+    A filtered result is materialized once, as an Arrow `table` (see
+    `db.materialize`; update_dashboard already built it while validating the
+    query), and each output's projection or aggregate runs over that copy,
+    registered as `RESULT_VIEW`, instead of re-running the query. Outputs ask
+    for the columns they use, so nothing converts the whole result to pandas
+    unless something actually needs all of it. Results are memoized.
+    """
+
+    def __init__(
+        self,
+        sql: str,
+        table: pa.Table | None = None,
+        frame: pd.DataFrame | None = None,
+    ):
+        self.sql = sql
+        self.table = table
+        self.source = RESULT_VIEW if table is not None else query_source(sql)
+        # The full result, if it is already in memory (e.g. the unfiltered data)
+        self._frame = frame
+        self._memo: dict[str, asyncio.Future[pd.DataFrame]] = {}
+
+    def _run(self, cur: duckdb.DuckDBPyConnection, sql: str) -> pd.DataFrame:
+        if self.table is None:
+            return query_df(cur, sql)
+        # Registrations are per cursor, and a cursor runs one call at a time.
+        # Not through the shared cache: in another session, RESULT_VIEW is
+        # another result.
+        cur.register(RESULT_VIEW, self.table)
+        try:
+            return cur.query(sql).df()
+        finally:
+            cur.unregister(RESULT_VIEW)
+
+    async def run(self, sql: str) -> pd.DataFrame:
+        """Run `sql` (which should select from `self.source`) in the cursor
+        pool, off the event loop."""
+        return await pool.run(lambda cur: self._run(cur, sql))
+
+    async def query(self, sql: str) -> pd.DataFrame:
+        """Like `run`, but memoized."""
+        if sql not in self._memo:
+            # Memoize the task, so outputs asking at the same time share one run
+            self._memo[sql] = asyncio.ensure_future(self.run(sql))
+        return await self._memo[sql]
+
+    async def df(self, columns: list[str] | None = None) -> pd.DataFrame:
+        if self._frame is not None:
+            return self._frame if columns is None else self._frame[columns]
+        projection = ", ".join(quote(c) for c in columns) if columns else "*"
+        return await self.query(f"SELECT {projection} FROM {self.source} AS current")
+
+    async def row_count(self) -> int:
+        if self.table is not None:
+            return self.table.num_rows
+        if self._frame is not None:
+            return len(self._frame)
+        return int((await self.query(f"SELECT count(*) AS n FROM {self.source} AS current")).n.iloc[0])
+
+    async def columns(self) -> list[str]:
+        if self.table is not None:
+            return self.table.column_names
+        if self._frame is not None:
+            return list(self._frame.columns)
+        return list((await self.query(f"SELECT * FROM {self.source} AS current LIMIT 0")).columns)
+
+
+def summary_sql(source: str) -> str:
+    """One aggregate over the dashboard data, feeding all the value boxes."""
+    return f"""
+SELECT
+  count(*) AS tippers,
+  avg(tip / total_bill) AS average_tip,
+  avg(total_bill) AS average_bill
+FROM {source} AS current
+"""
+
+
+@dataclass(frozen=True)
+class AggregateChart:
+    """A grouped bar chart of aggregates over the dashboard data.
+
+    The aggregation is a GROUP BY that DuckDB runs over the dashboard data,
+    so only one row per group reaches Python, and the result is memoized
+    like any other output's.
+    """
+
+    group_by: str
+    # Output column -> SQL aggregate expression, e.g. {"tip": "avg(tip)"}
+    measures: dict[str, str]
+    title: str | None = None
+    labels: dict[str, str] = field(default_factory=dict)
+
+    def sql(self, source: str) -> str:
+        measures = ",\n  ".join(f"{expr} AS {quote(name)}" for name, expr in self.measures.items())
+        group = quote(self.group_by)
+        return f"""
+SELECT
+  {group},
+  {measures}
+FROM {source} AS current
+WHERE {group} IS NOT NULL
+GROUP BY {group}
+ORDER BY {group}
+"""
+
+    async def figure(self, data: LazyResult) -> go.Figure:
+        return px.bar(
+            await data.query(self.sql(data.source)),
+            x=self.group_by,
+            y=list(self.measures),
+            barmode="group",
+            labels=self.labels,
+            title=self.title,
+        )
+
+
+# Above this many rows the scatter plot draws with WebGL, and above the
+# second threshold it only draws a random sample of the points
+SCATTER_WEBGL_THRESHOLD = 5_000
+SCATTER_MAX_POINTS = 50_000
+# The trendline is fit to the mean of each of this many total_bill bins
+TREND_BINS = 50
+
+
+def trend_sql(source: str, color: str | None) -> str:
+    group = f"{quote(color)}, " if color else ""
+    return f"""
+WITH current AS (SELECT * FROM {source}),
+bounds AS (SELECT min(total_bill) AS lo, max(total_bill) AS hi FROM current)
+SELECT
+  {group}avg(total_bill) AS total_bill,
+  avg(tip) AS tip
+FROM current, bounds
+WHERE total_bill IS NOT NULL AND tip IS NOT NULL
+GROUP BY {group}least(floor((total_bill - lo) / nullif(hi - lo, 0) * {TREND_BINS}), {TREND_BINS - 1})
+ORDER BY {group}total_bill
+"""
+
+
+def smooth(trend: pd.DataFrame) -> pd.DataFrame:
+    # LOWESS over the bin means: at most TREND_BINS points, so it costs the
+    # same no matter how many rows are being plotted
+    from statsmodels.nonparametric.smoothers_lowess import lowess
+
+    if len(trend) < 3:
+        return trend
+    fitted = lowess(trend.tip, trend.total_bill, frac=2 / 3, return_sorted=False)
+    return trend.assign(tip=fitted)
+
+
+async def scatter_figure(data: LazyResult, color: str | None = None) -> go.Figure:
+    """Total bill vs. tip, with a LOWESS trendline per color group.
+
+    The trendline is fit to binned means computed in DuckDB rather than to
+    every point. Large results are drawn with WebGL and, past
+    SCATTER_MAX_POINTS, from a random sample.
+    """
+    columns = ["total_bill", "tip"] + ([color] if color else [])
+    n = await data.row_count()
+    if n > SCATTER_MAX_POINTS:
+        projection = ", ".join(quote(c) for c in columns)
+        points = await data.query(
+            f"SELECT {projection} FROM {data.source} AS current "
+            f"USING SAMPLE reservoir({SCATTER_MAX_POINTS} ROWS) REPEATABLE (42)"
+        )
+    else:
+        points = await data.df(columns)
+
+    trend = await data.query(trend_sql(data.source, color))
+    if color:
+        groups = [smooth(group) for _, group in trend.groupby(color, observed=True, sort=False)]
+        # An empty result has no groups (and nothing to concatenate)
+        trend = pd.concat(groups, ignore_index=True) if groups else trend
+        # Same group order for points and lines, so they get the same colors
+        orders = {color: sorted(trend[color].dropna().unique().tolist())}
+    else:
+        trend = smooth(trend)
+        orders = {}
+
+    fig = px.scatter(
+        points,
+        x="total_bill",
+        y="tip",
+        color=color,
+        category_orders=orders,
+        render_mode="webgl" if n > SCATTER_WEBGL_THRESHOLD else "auto",
+    )
+    lines = px.line(trend, x="total_bill", y="tip", color=color, category_orders=orders)
+    fig.add_traces(lines.update_traces(showlegend=False).data)
+    return fig
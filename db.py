@@ -0,0 +1,446 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, TypeVar
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+import shared
+from shared import con
+
+T = TypeVar("T")
+
+POOL_SIZE = int(os.environ.get("DUCKDB_POOL_SIZE", "4"))
+# Seconds an async query may run before it is interrupted (not counting time
+# spent waiting for a cursor)
+QUERY_TIMEOUT = float(os.environ.get("DUCKDB_QUERY_TIMEOUT", "30"))
+# Memory budget for query results shared across sessions
+RESULT_CACHE_BYTES = int(os.environ.get("QUERY_CACHE_BYTES", str(256 * 1024**2)))
+# Memory budget for materialized dashboard results (see `materialize`)
+DASHBOARD_CACHE_BYTES = int(os.environ.get("DASHBOARD_CACHE_BYTES", str(256 * 1024**2)))
+# Bounds on query results returned to the model by the query_db tool
+RESULT_MAX_ROWS = 50
+RESULT_MAX_BYTES = 16 * 1024
+
+
+class InterruptibleCall:
+    """One `fn(cursor)` call on a worker thread that other threads can stop.
+
+    DuckDB forgets an interrupt that arrives before a query starts, so
+    `stop` keeps interrupting until the call returns, and a call stopped
+    before it started never runs at all.
+    """
+
+    def __init__(self, fn: Callable[[duckdb.DuckDBPyConnection], T]):
+        self.fn = fn
+        self.timed_out = False
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._cursor: duckdb.DuckDBPyConnection | None = None
+        self._done = threading.Event()
+
+    def __call__(self, cur: duckdb.DuckDBPyConnection) -> T:
+        with self._lock:
+            if self._stopped:
+                raise duckdb.InterruptException("Query was cancelled before it started")
+            self._cursor = cur
+        try:
+            return self.fn(cur)
+        finally:
+            # Stop tracking before the cursor can be handed to someone else
+            with self._lock:
+                self._cursor = None
+            self._done.set()
+
+    def stop(self, timed_out: bool = False) -> None:
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self.timed_out = timed_out
+        threading.Thread(target=self._interrupt_until_done, daemon=True).start()
+
+    def _interrupt_until_done(self) -> None:
+        while True:
+            with self._lock:
+                if self._cursor is None:
+                    return
+                self._cursor.interrupt()
+            if self._done.wait(0.05):
+                return
+
+
+class CursorPool:
+    """A bounded pool of DuckDB cursors over one shared database.
+
+    Callers (the chat tools and the dashboard's reactive calcs) check out
+    one of the pool's cursors and run their query on the pool's worker
+    threads, so concurrent sessions don't serialize on a single connection
+    or block the event loop, and every query is subject to the timeout.
+    """
+
+    def __init__(self, connection: duckdb.DuckDBPyConnection, size: int):
+        self.size = size
+        self._idle: queue.SimpleQueue[duckdb.DuckDBPyConnection] = queue.SimpleQueue()
+        for _ in range(size):
+            self._idle.put(connection.cursor())
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="duckdb")
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._checkouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @contextmanager
+    def cursor(self):
+        start = time.perf_counter()
+        cur = self._idle.get()
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        try:
+            yield cur
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(cur)
+
+    def _run_call(self, call: InterruptibleCall, timeout: float | None):
+        with self.cursor() as cur:
+            # The timeout counts from when the query starts, not from when it
+            # was submitted, and is enforced off the event loop
+            timer = threading.Timer(timeout, call.stop, kwargs={"timed_out": True}) if timeout else None
+            if timer is not None:
+                timer.daemon = True
+                timer.start()
+            try:
+                return call(cur)
+            except duckdb.InterruptException:
+                if call.timed_out:
+                    raise TimeoutError(
+                        f"Query was cancelled after running for more than {timeout:g} seconds"
+                    ) from None
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    async def run(
+        self,
+        fn: Callable[[duckdb.DuckDBPyConnection], T],
+        timeout: float | None = QUERY_TIMEOUT,
+    ) -> T:
+        """Call `fn` with a checked-out cursor on a worker thread.
+
+        If the query runs for more than `timeout` seconds, it is interrupted
+        and TimeoutError is raised. If the awaiting task is cancelled, the
+        query is interrupted too (or never started), so the cursor goes back
+        to the pool instead of finishing work nobody is waiting for.
+        """
+        call = InterruptibleCall(fn)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._run_call, call, timeout)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            call.stop()
+            # The worker will now fail with an InterruptException nobody awaits
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "avg_wait_ms": 1000 * self._total_wait / max(self._checkouts, 1),
+                "max_wait_ms": 1000 * self._max_wait,
+            }
+
+
+def check_select(cur: duckdb.DuckDBPyConnection, sql: str) -> None:
+    """Throw unless `sql` is a single SELECT statement (the only kind the
+    chatbot and the dashboard may run)."""
+    statements = cur.extract_statements(sql)
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        raise ValueError("Only a single SELECT statement can be run")
+
+
+def check_query(cur: duckdb.DuckDBPyConnection, sql: str) -> None:
+    """Bind and plan `sql` without running it; throws if the query is invalid."""
+    cur.execute(f"EXPLAIN {sql}")
+
+
+def _quoted_end(chunk: str, start: int, quote: str, backslash: bool = False) -> int | None:
+    # Index just past the closing `quote` (doubled quotes are escapes)
+    i = start + 1
+    while i < len(chunk):
+        if backslash and chunk[i] == "\\":
+            i += 2
+            continue
+        if chunk[i] == quote:
+            if chunk[i + 1 : i + 2] == quote:
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    return None
+
+
+def _token_text(chunk: str, kind) -> str:
+    # A chunk runs from the start of one token to the start of the next, so it
+    # may carry trailing whitespace and comments that need to be cut off.
+    # Literals and quoted identifiers can contain `--` or `/*` themselves, so
+    # they are cut at their closing quote instead, or kept whole if unsure.
+    end = None
+    if kind == duckdb.token_type.string_const:
+        if chunk.startswith("$"):
+            tag_end = chunk.find("$", 1)
+            if tag_end != -1:
+                tag = chunk[: tag_end + 1]
+                close = chunk.find(tag, tag_end + 1)
+                end = None if close == -1 else close + len(tag)
+        else:
+            # Optional prefix such as E, X or B before the opening quote
+            start = chunk.find("'")
+            if start != -1 and (start == 0 or chunk[:start].isalpha()):
+                end = _quoted_end(chunk, start, "'", backslash=chunk[:start].lower() == "e")
+        return chunk[:end].strip() if end is not None else chunk.strip()
+    if chunk.startswith('"'):
+        end = _quoted_end(chunk, 0, '"')
+        return chunk[:end].strip() if end is not None else chunk.strip()
+    for marker in ("--", "/*"):
+        chunk = chunk.split(marker, 1)[0]
+    return chunk.strip()
+
+
+def _tokens(sql: str) -> list[tuple[str, duckdb.token_type]] | None:
+    try:
+        tokens = duckdb.tokenize(sql)
+    except Exception:
+        return None
+    ends = [pos for pos, _ in tokens[1:]] + [len(sql)]
+    return [(_token_text(sql[pos:end], kind), kind) for (pos, kind), end in zip(tokens, ends)]
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical text for `sql` that ignores whitespace, comments, keyword case
+    and trailing semicolons, using DuckDB's tokenizer."""
+    tokens = _tokens(sql)
+    if tokens is None:
+        return " ".join(sql.split())
+    parts = [text.lower() if kind == duckdb.token_type.keyword else text for text, kind in tokens]
+    while parts and parts[-1] == ";":
+        parts.pop()
+    return " ".join(parts)
+
+
+# Functions whose result differs from one run to the next
+NONDETERMINISTIC_FUNCTIONS = {
+    "random", "gen_random_uuid", "uuid", "uuidv4", "uuidv7", "setseed",
+    "now", "current_timestamp", "current_date", "current_time", "today",
+    "get_current_time", "get_current_timestamp", "localtime", "localtimestamp",
+    "transaction_timestamp",
+}
+
+
+def is_deterministic(sql: str) -> bool:
+    """Whether running `sql` twice on the same data gives the same result.
+
+    A conservative check on the tokens: any use of a random or clock
+    function, or a sample without a REPEATABLE seed, counts as
+    nondeterministic.
+    """
+    tokens = _tokens(sql)
+    if tokens is None:
+        return False
+    words = [
+        text.lower()
+        for text, kind in tokens
+        if kind in (duckdb.token_type.keyword, duckdb.token_type.identifier)
+    ]
+    if NONDETERMINISTIC_FUNCTIONS.intersection(words):
+        return False
+    samples = "sample" in words or "tablesample" in words
+    return not samples or "repeatable" in words
+
+
+def query_source(sql: str, table: str = "tips") -> str:
+    """A FROM-clause source for the dashboard query `sql` (`table` if empty).
+
+    The query is wrapped as a subquery, with trailing semicolons dropped and
+    the closing parenthesis on its own line so a trailing `--` comment can't
+    swallow it.
+    """
+    if sql.strip() == "":
+        return table
+    end = len(sql)
+    for pos, _ in reversed(duckdb.tokenize(sql)):
+        if sql[pos] != ";":
+            break
+        end = pos
+    return f"(\n{sql[:end]}\n)"
+
+
+class ResultCache:
+    """Process-wide LRU cache of query results, bounded by memory size.
+
+    Keys combine the normalized SQL with `shared.data_version`. Cached results
+    (DataFrames or Arrow tables) are shared between sessions and must not be
+    modified in place. Queries that aren't deterministic (see
+    `is_deterministic`) are never cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, str], tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, sql: str, compute: Callable[[], T]) -> T:
+        if not is_deterministic(sql):
+            # Another session would get this run's "random" result
+            return compute()
+        key = (shared.data_version, normalize_sql(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        result = compute()
+        if isinstance(result, pa.Table):
+            nbytes = result.nbytes
+        else:
+            nbytes = int(result.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return result
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (result, nbytes)
+                self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+result_cache = ResultCache(RESULT_CACHE_BYTES)
+dashboard_results = ResultCache(DASHBOARD_CACHE_BYTES)
+
+
+def query_df(cur: duckdb.DuckDBPyConnection, sql: str) -> pd.DataFrame:
+    """Run `sql` on `cur` as a DataFrame, going through the shared result cache.
+
+    Only a single SELECT statement is accepted.
+    """
+    check_select(cur, sql)
+    return result_cache.get_or_compute(sql, lambda: cur.query(sql).df())
+
+
+def materialize(cur: duckdb.DuckDBPyConnection, sql: str) -> pa.Table:
+    """Run the dashboard query `sql` in full, as an Arrow table.
+
+    update_dashboard validates a query this way, so run-time errors surface,
+    and the table is cached in `dashboard_results`: the dashboard's outputs
+    then query that copy (see `dashboard.LazyResult`) rather than each
+    re-running `sql`.
+    """
+    check_select(cur, sql)
+    return dashboard_results.get_or_compute(sql, lambda: cur.query(sql).to_arrow_table())
+
+
+def _to_python(value):
+    # NumPy scalars -> plain Python values, so they serialize as JSON numbers
+    return value.item() if hasattr(value, "item") else value
+
+
+def column_stats(series: pd.Series) -> dict:
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return {
+            "type": str(series.dtype),
+            "nulls": int(series.isna().sum()),
+            "min": _to_python(series.min()),
+            "max": _to_python(series.max()),
+            "mean": _to_python(series.mean()),
+        }
+    counts = series.value_counts()
+    return {
+        "type": str(series.dtype),
+        "nulls": int(series.isna().sum()),
+        "distinct": int((counts > 0).sum()),
+        "most_common": {str(k): int(v) for k, v in counts.head(5).items()},
+    }
+
+
+def shape_result(
+    df: pd.DataFrame,
+    max_rows: int = RESULT_MAX_ROWS,
+    max_bytes: int = RESULT_MAX_BYTES,
+) -> str:
+    """Serialize a query result for the model, keeping the output bounded.
+
+    Small results are returned as JSON records. Anything larger becomes a
+    summary with the total row count, per-column statistics and as many of
+    the first rows as fit, flagged as truncated.
+    """
+    if len(df) <= max_rows:
+        records = df.to_json(orient="records")
+        if len(records) <= max_bytes:
+            return records
+
+    if len(df) > max_rows:
+        reason = f"The result has {len(df)} rows, too many to return in full."
+    else:
+        reason = f"The result has only {len(df)} rows, but they are too large to return in full."
+    summary = {
+        "truncated": True,
+        "note": (
+            f"{reason} Only column statistics and the first rows that fit are "
+            "shown; use a more selective or aggregating query to see more."
+        ),
+        "row_count": len(df),
+        "columns": {str(name): column_stats(df[name]) for name in df.columns},
+        "first_rows": [],
+    }
+    n = min(len(df), max_rows)
+    while True:
+        summary["first_rows"] = json.loads(df.head(n).to_json(orient="records"))
+        text = json.dumps(summary, default=str)
+        if len(text) <= max_bytes or n == 0:
+            return text
+        n //= 2
+
+
+pool = CursorPool(con, POOL_SIZE)
@@ -1,7 +1,6 @@
 from pathlib import Path
 from typing import Literal, TypeVar
 
-import duckdb
 import pandas as pd
 from inspect_ai import Task, task
 from inspect_ai.dataset import csv_dataset
@@ -18,14 +17,15 @@ from inspect_ai.tool import tool
 from inspect_ai.util import StoreModel, store_as
 from pydantic import Field
 
+from db import materialize
 from query import system_prompt
-from shared import tips
+from shared import con, data_version, tips
 
 T = TypeVar("T")
 
 pd.read_csv("tips.csv")
 
-sys_prompt = system_prompt(tips, "tips")
+sys_prompt = system_prompt(tips, "tips", version=data_version)
 
 
 class UpdateDashboardCall(StoreModel):
@@ -46,8 +46,10 @@ def update_dashboard():
         sm = store_as(UpdateDashboardCall)
         sm.calls.append((query, title))
 
+        # Validate the way the apps do: run the query in full, so run-time
+        # errors count against the model too
         if query != "":
-            duckdb.query(query).to_df()
+            materialize(con, query)
 
         return None
 
@@ -62,7 +64,7 @@ def query_db():
         Args:
             query: A DuckDB SQL query; must be a SELECT statement.
         """
-        return duckdb.query(query).to_df().to_json(orient="records")
+        return con.query(query).to_df().to_json(orient="records")
 
     return execute
 
@@ -94,8 +96,8 @@ def sql_scorer():
         if last_query is None:
             return Score(value="C", answer=last_query)
 
-        results = duckdb.query(last_query).to_df()
-        expected_results = duckdb.query(target.text).to_df()
+        results = con.query(last_query).to_df()
+        expected_results = con.query(target.text).to_df()
 
         value, explanation = compare_data_frames(results, expected_results)
 
@@ -1,9 +1,18 @@
+import asyncio
 import base64
-import tempfile
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import chatlas
 import plotly.graph_objects as go
+import plotly.io as pio
 from shiny import ui
+from shiny.session import get_current_session
+from starlette.responses import Response
 
 INSTRUCTIONS = """
 Interpret this plot, which is based on the current state of the data (i.e. with
@@ -14,17 +23,217 @@ can't be confident.
 
 counter = 0  # Never re-use the same chat ID
 
+# Plots are rendered in long-lived worker processes: image export (Kaleido)
+# is slow to start, and would block the event loop if run inline. Apps call
+# render_pool() at startup so the workers are warm before the first click.
+RENDER_WORKERS = 2
+
+# plotly `to_image` arguments for the image shown to the user, and for the
+# smaller, compressed one sent to the model (vision cost grows with size)
+DISPLAY_IMAGE = dict(format="png", width=700, height=500)
+MODEL_IMAGE = dict(format="jpeg", width=512, height=384)
+
+# Serve the displayed image from a per-session route rather than inlining it
+# in the modal's HTML as a base64 data URL
+SERVE_DISPLAY_IMAGE = True
+
+_render_pool: ProcessPoolExecutor | None = None
+
+
+def render_image(fig_json: str, options: dict) -> bytes:
+    return pio.from_json(fig_json).to_image(**options)
+
+
+def _warm_up() -> None:
+    try:
+        render_image(go.Figure().to_json(), MODEL_IMAGE)
+    except Exception:
+        # Leave it to real renders to surface the problem to the user
+        pass
+
+
+def render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up,
+        )
+        # Start (and warm up) the workers now, not on the first click
+        for _ in range(RENDER_WORKERS):
+            _render_pool.submit(int)
+    return _render_pool
+
+
+def discard_render_pool(pool: ProcessPoolExecutor) -> None:
+    global _render_pool
+    if _render_pool is pool:
+        _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def render_plot(fig_json: str, options: dict, render=render_image) -> bytes:
+    """Render a plot to image bytes in the render pool, off the event loop.
+
+    `render` runs in a worker process, so it must be picklable (a module-level
+    function). If a worker has died (e.g. Kaleido crashed), the broken pool
+    is replaced and the render retried once, rather than failing every later
+    render.
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = render_pool()
+        try:
+            return await loop.run_in_executor(pool, render, fig_json, options)
+        except BrokenProcessPool:
+            discard_render_pool(pool)
+            if attempt == 1:
+                raise
+
+
+def data_url(img: bytes, format: str) -> str:
+    return f"data:image/{format};base64,{base64.b64encode(img).decode('utf-8')}"
+
+
+def serve_image(name: str, img: bytes, format: str) -> str:
+    """Serve `img` from a route of the current session, returning its URL."""
+
+    async def handler(request):
+        return Response(img, media_type=f"image/{format}")
+
+    return get_current_session().dynamic_route(name, handler)
+
+
+class PlotCache:
+    """Rendered plots and their explanations, shared across sessions.
+
+    Each entry holds the displayed image and the data URL of the image sent
+    to the model, keyed by a hash of the figure JSON plus the model name, so
+    a plot whose data changed (e.g. after filtering) never matches an old
+    entry. Those are safe to share between sessions.
+
+    Explanations are not: the model answers in the context of the
+    conversation so far. So an entry also keeps the turns (question, answer)
+    of explanations by `context_key`, a hash of the conversation they were
+    asked in, and one is only replayed into an identical conversation.
+    Least recently used entries are evicted to stay within `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.explanation_hits = 0
+
+    @staticmethod
+    def key(fig_json: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{fig_json}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def context_key(chat_session: chatlas.Chat) -> str:
+        h = hashlib.sha256((chat_session.system_prompt or "").encode("utf-8"))
+        for turn in chat_session.get_turns():
+            h.update(b"\0")
+            h.update(turn.model_dump_json().encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, display_img: bytes, model_img_url: str) -> dict:
+        entry = {
+            "display_img": display_img,
+            "model_img_url": model_img_url,
+            "explanations": {},
+            "nbytes": len(display_img) + len(model_img_url),
+        }
+        with self._lock:
+            self._store(key, entry)
+        return entry
+
+    def get_explanation(self, key: str, context: str) -> list[chatlas.Turn] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            turns = None if entry is None else entry["explanations"].get(context)
+            if turns is not None:
+                self.explanation_hits += 1
+            return turns
+
+    def set_explanation(self, key: str, context: str, turns: list[chatlas.Turn]) -> None:
+        """Remember the turns (question, answer) of an explanation asked in
+        the conversation identified by `context`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or context in entry["explanations"]:
+                return
+            entry["explanations"][context] = turns
+            extra = sum(len(t.text) for t in turns)
+            entry["nbytes"] += extra
+            self._bytes += extra
+            self._evict()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "explanation_hits": self.explanation_hits,
+            }
+
+    def _store(self, key: str, entry: dict) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old["nbytes"]
+        self._entries[key] = entry
+        self._bytes += entry["nbytes"]
+        self._evict()
+
+    def _evict(self) -> None:
+        # Always keep the newest entry, even if it alone is over budget
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted["nbytes"]
+
+
+plot_cache = PlotCache(max_bytes=64 * 1024**2)
+
 
 async def explain_plot(
     chat_session: chatlas.Chat,
     plot_widget: go.FigureWidget,
 ) -> None:
     try:
-        with tempfile.TemporaryFile() as f:
-            plot_widget.write_image(f)
-            f.seek(0)
-            img_b64 = base64.b64encode(f.read()).decode("utf-8")
-            img_url = f"data:image/png;base64,{img_b64}"
+        fig_json = plot_widget.to_json()
+        key = plot_cache.key(fig_json, chat_session.provider.model)
+        entry = plot_cache.get(key)
+        if entry is None:
+            display_img, model_img = await asyncio.gather(
+                render_plot(fig_json, DISPLAY_IMAGE),
+                render_plot(fig_json, MODEL_IMAGE),
+            )
+            entry = plot_cache.put(
+                key, display_img, data_url(model_img, MODEL_IMAGE["format"])
+            )
+
+        if SERVE_DISPLAY_IMAGE:
+            img_src = serve_image(
+                f"explain_plot_{key[:16]}", entry["display_img"], DISPLAY_IMAGE["format"]
+            )
+        else:
+            img_src = data_url(entry["display_img"], DISPLAY_IMAGE["format"])
 
         global counter
         counter += 1
@@ -32,15 +241,32 @@ async def explain_plot(
         chat = ui.Chat(id=chat_id)
 
         # TODO: Call chat.destroy() when the modal is dismissed?
-        dialog = make_modal_dialog(img_url, ui.chat_ui(id=chat_id, height="100%"))
+        dialog = make_modal_dialog(img_src, ui.chat_ui(id=chat_id, height="100%"))
         ui.modal_show(dialog)
 
-        async def ask(*user_prompt: str | chatlas.types.Content):
+        async def ask(*user_prompt: str | chatlas.types.Content, on_done=None):
             resp = await chat_session.stream_async(*user_prompt)
+            if on_done is not None:
+                resp = tee_stream(resp, on_done)
             await chat.append_message_stream(resp)
 
-        # Ask the initial question
-        await ask(INSTRUCTIONS, chatlas.content_image_url(img_url))
+        context = plot_cache.context_key(chat_session)
+        turns = plot_cache.get_explanation(key, context)
+        if turns is not None:
+            # This exact plot has been explained in this exact conversation
+            # before; replay that answer
+            chat_session.set_turns([*chat_session.get_turns(), *turns])
+            await chat.append_message(turns[-1].text)
+        else:
+            # Ask the initial question, and remember the answer once it's complete
+            n_turns = len(chat_session.get_turns())
+            await ask(
+                INSTRUCTIONS,
+                chatlas.content_image_url(entry["model_img_url"]),
+                on_done=lambda: plot_cache.set_explanation(
+                    key, context, chat_session.get_turns()[n_turns:]
+                ),
+            )
 
         # Allow followup questions
         @chat.on_user_submit
@@ -54,7 +280,14 @@ async def explain_plot(
         ui.notification_show(str(e), type="error")
 
 
-def make_modal_dialog(img_url, chat_ui):
+async def tee_stream(stream, on_done):
+    # Pass the stream through, then call on_done once it has been fully consumed
+    async for chunk in stream:
+        yield chunk
+    on_done()
+
+
+def make_modal_dialog(img_src, chat_ui):
     return ui.modal(
         ui.tags.button(
             type="button",
@@ -63,7 +296,7 @@ def make_modal_dialog(img_url, chat_ui):
             aria_label="Close",
         ),
         ui.img(
-            src=img_url,
+            src=img_src,
             style="max-width: min(100%, 500px);",
             class_="d-block border mx-auto mb-3",
         ),
@@ -75,4 +308,4 @@ def make_modal_dialog(img_url, chat_ui):
         easy_close=True,
         title=None,
         footer=None,
-    ).add_style("--bs-modal-margin: 1.75rem;")
\ No newline at end of file
+    ).add_style("--bs-modal-margin: 1.75rem;")
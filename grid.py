@@ -0,0 +1,120 @@
+from shiny import module, reactive, render, ui
+
+GRID_PAGE_SIZE = 100
+
+
+@module.ui
+def lazy_grid_ui(columns: list[str]):
+    return ui.TagList(
+        ui.output_data_frame("grid"),
+        ui.div(
+            ui.input_action_button("prev_page", "Previous", class_="btn-sm"),
+            ui.output_text("page_info", inline=True),
+            ui.input_action_button("next_page", "Next", class_="btn-sm"),
+            ui.input_select(
+                "sort_by",
+                None,
+                {"": "Query order", **{c: f"Sort by {c}" for c in columns}},
+                width="auto",
+            ),
+            ui.input_checkbox("descending", "Descending"),
+            class_="d-flex gap-3 align-items-center mt-2",
+        ),
+    )
+
+
+@module.server
+def lazy_grid_server(input, output, session, data, page_size: int = GRID_PAGE_SIZE):
+    """A data grid over `data` (a calc returning the dashboard's LazyResult)
+    that only ever fetches the visible page. Sorting and paging are done by
+    DuckDB."""
+
+    page = reactive.value(0)
+
+    @reactive.calc
+    async def row_count():
+        return await (await data()).row_count()
+
+    @reactive.calc
+    async def result_columns():
+        return await (await data()).columns()
+
+    @reactive.effect
+    async def update_sort_choices():
+        # The query may project or rename columns; only offer ones it returns
+        columns = await result_columns()
+        with reactive.isolate():
+            selected = input.sort_by() if input.sort_by() in columns else ""
+        ui.update_select(
+            "sort_by",
+            choices={"": "Query order", **{c: f"Sort by {c}" for c in columns}},
+            selected=selected,
+        )
+
+    @reactive.effect
+    @reactive.event(data, input.sort_by, input.descending)
+    async def reset_page():
+        page.set(0)
+
+    @reactive.effect
+    @reactive.event(input.prev_page)
+    def prev_page():
+        page.set(max(page() - 1, 0))
+
+    @reactive.effect
+    @reactive.event(input.next_page)
+    async def next_page():
+        last_page = max((await row_count() - 1) // page_size, 0)
+        page.set(min(page() + 1, last_page))
+
+    @render.text
+    async def page_info():
+        n = await row_count()
+        start = page() * page_size
+        return f"Rows {min(start + 1, n)}–{min(start + page_size, n)} of {n}"
+
+    @render.data_frame
+    async def grid():
+        result = await data()
+        sql = page_sql(
+            result.source,
+            page(),
+            page_size,
+            sort_by=input.sort_by(),
+            descending=input.descending(),
+            columns=await result_columns(),
+        )
+        # Not memoized: each page is only needed while it's shown
+        return render.DataGrid(await result.run(sql))
+
+
+def page_sql(
+    source: str,
+    page: int,
+    page_size: int,
+    sort_by: str = "",
+    descending: bool = False,
+    columns: list[str] = (),
+) -> str:
+    """SQL for one page of the rows of `source`, optionally sorted.
+
+    `source` is a table or a subquery, like `db.query_source` returns.
+
+    `sort_by` is ignored unless it is one of the result's `columns`: until
+    the sort choices catch up with a new query, it may name a column that
+    the query no longer returns.
+
+    Rows that tie on `sort_by` are ordered by their position in the result
+    (as `__row`, which the page leaves out); otherwise DuckDB may order them
+    differently for each page, so pages would repeat some rows and skip others.
+    """
+    if sort_by and sort_by in columns:
+        column = sort_by.replace('"', '""')
+        sql = (
+            f"SELECT * EXCLUDE (__row) FROM (SELECT *, row_number() OVER () AS __row"
+            f" FROM {source} AS current)"
+            f' ORDER BY "{column}" {"DESC" if descending else "ASC"}, __row'
+        )
+    else:
+        sql = f"SELECT * FROM {source} AS current"
+    return sql + f" LIMIT {page_size} OFFSET {page * page_size}"
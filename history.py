@@ -0,0 +1,116 @@
+import json
+import os
+
+import chatlas
+from chatlas.types import ContentToolRequest, ContentToolResult
+
+# Approximate number of tokens the conversation history may take up
+HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKENS", "30000"))
+# Tool results in this many of the most recent turns are always kept verbatim
+KEEP_RECENT_TURNS = 6
+
+OMITTED_RESULT = "[Result omitted to save space; run the query again if it is needed.]"
+
+
+def content_text(content) -> str:
+    for attr in ("text", "value", "arguments", "data"):
+        value = getattr(content, attr, None)
+        if value is not None:
+            return value if isinstance(value, str) else json.dumps(value, default=str)
+    return ""
+
+
+def estimate_tokens(turn: chatlas.Turn) -> int:
+    # Roughly four characters per token, plus a little overhead per message
+    return 4 + sum(len(content_text(c)) for c in turn.contents) // 4
+
+
+def starts_exchange(turn: chatlas.Turn) -> bool:
+    # A user turn that isn't just returning tool results starts a new exchange
+    return turn.role == "user" and not any(
+        isinstance(c, ContentToolResult) for c in turn.contents
+    )
+
+
+def updates_dashboard(turn: chatlas.Turn) -> bool:
+    return any(
+        isinstance(c, ContentToolRequest) and c.name == "update_dashboard"
+        for c in turn.contents
+    )
+
+
+def compact_turns(
+    turns: list[chatlas.Turn], budget: int = HISTORY_TOKEN_BUDGET
+) -> list[chatlas.Turn]:
+    """Shrink a conversation to roughly `budget` tokens.
+
+    First, tool results older than the last KEEP_RECENT_TURNS turns are
+    replaced with a short placeholder (those from query_db can be large).
+    If that isn't enough, the oldest whole exchanges (a user message and
+    everything up to the next one) are dropped. The latest exchange and the
+    one with the most recent `update_dashboard` call are always kept, so the
+    model still knows what the dashboard is currently showing.
+    """
+    sizes = [estimate_tokens(t) for t in turns]
+    if sum(sizes) <= budget:
+        return turns
+
+    turns = list(turns)
+    for i in range(len(turns) - KEEP_RECENT_TURNS):
+        turn = turns[i]
+        if not any(isinstance(c, ContentToolResult) for c in turn.contents):
+            continue
+        contents = [
+            c.model_copy(update={"value": OMITTED_RESULT})
+            if isinstance(c, ContentToolResult) and c.value != OMITTED_RESULT
+            else c
+            for c in turn.contents
+        ]
+        turns[i] = turn.model_copy(update={"contents": contents})
+        sizes[i] = estimate_tokens(turns[i])
+    if sum(sizes) <= budget:
+        return turns
+
+    starts = [i for i, t in enumerate(turns) if starts_exchange(t)] or [0]
+    if starts[0] != 0:
+        starts.insert(0, 0)
+    exchanges = [range(a, b) for a, b in zip(starts, starts[1:] + [len(turns)])]
+    dashboard = [e for e in exchanges if any(updates_dashboard(turns[i]) for i in e)]
+    pinned = {id(exchanges[-1])} | ({id(dashboard[-1])} if dashboard else set())
+
+    total = sum(sizes)
+    kept = []
+    for exchange in exchanges:
+        size = sum(sizes[i] for i in exchange)
+        if total > budget and id(exchange) not in pinned:
+            total -= size
+        else:
+            kept.extend(turns[i] for i in exchange)
+    return kept
+
+
+def compact_history(chat_session: chatlas.Chat, budget: int = HISTORY_TOKEN_BUDGET) -> None:
+    """Keep the history of `chat_session` within `budget` (see `compact_turns`)."""
+    turns = chat_session.get_turns()
+    compacted = compact_turns(turns, budget)
+    if compacted is not turns:
+        chat_session.set_turns(compacted)
+
+
+def fork_chat(parent: chatlas.Chat) -> chatlas.Chat:
+    """Branch `parent` into a new Chat that continues the conversation without
+    affecting it.
+
+    The fork reuses the parent's provider (and so its API client) and its
+    registered Tool objects, so no client is constructed and no tool schemas
+    are rebuilt. Turns are never modified in place, so they are shared too;
+    only the list holding them is copied.
+    """
+    fork = chatlas.Chat(
+        provider=parent.provider,
+        system_prompt=parent.system_prompt,
+        kwargs_chat=dict(parent.kwargs_chat),
+    )
+    fork.set_tools(parent.get_tools())
+    fork.set_turns(parent.get_turns())
+    return fork
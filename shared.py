@@ -1,8 +1,16 @@
+import json
 import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 from dotenv import load_dotenv
 from supabase import create_client, Client
 import duckdb
 import pandas as pd
+from pandas.api.types import union_categoricals
 
 load_dotenv()
 
@@ -14,24 +22,284 @@ if not url or not key:
 
 supabase: Client = create_client(url, key)
 
-response = supabase.table('tips').select("*", count="exact").execute()
-all_data = response.data
-total_rows = response.count
-
-if total_rows is not None and total_rows > len(all_data):
-    page = 1
-    page_size = 1000  # Default page size in Supabase
-    while len(all_data) < total_rows:
-        start_index = page * page_size
-        end_index = start_index + page_size - 1
-        response = supabase.table('tips').select("*").range(start_index, end_index).execute()
-        all_data.extend(response.data)
-        page += 1
-
-# response.data is a list of dictionaries
-# [{'id': 1, 'total_bill': 16.99, 'tip': 1.01, 'sex': 'Female', 'smoker': 'No', 'day': 'Sun', 'time': 'Dinner', 'size': 2}, ...]
-tips = pd.DataFrame(all_data)
+here = Path(__file__).parent
+
+PAGE_SIZE = 1000  # Default page size in Supabase
+LOAD_WORKERS = int(os.environ.get("TIPS_LOAD_WORKERS", "8"))
+LOAD_RETRIES = 3
+
+# Low-cardinality text columns, stored as pandas categoricals
+CATEGORICAL_COLUMNS = ["sex", "smoker", "day", "time"]
+
+# Local snapshots of remote tables. A snapshot younger than SNAPSHOT_MAX_AGE
+# seconds is used as-is; an older one is topped up with rows past its
+# watermark. Set SNAPSHOT_MAX_AGE to 0 to always check for new rows.
+SNAPSHOT_DIR = Path(os.environ.get("TIPS_SNAPSHOT_DIR", here / ".snapshots"))
+SNAPSHOT_MAX_AGE = float(os.environ.get("TIPS_SNAPSHOT_MAX_AGE", "300"))
+
+# On-disk DuckDB database holding `tips` as a native table (rebuilt only when
+# the data changes). It is attached read-only, so no query can modify the
+# data every session sees. Kept with the snapshots unless TIPS_DUCKDB_PATH
+# says otherwise.
+DUCKDB_PATH = Path(os.environ.get("TIPS_DUCKDB_PATH", SNAPSHOT_DIR / "tips.duckdb"))
+
+
+def select_rows(table: str, since_id: int | None, **kwargs):
+    request = supabase.table(table).select("*", **kwargs)
+    if since_id is not None:
+        request = request.gt("id", since_id)
+    return request.order("id")
+
+
+def execute_with_retries(request):
+    """Execute a Supabase request, retrying transient failures."""
+    for attempt in range(LOAD_RETRIES):
+        try:
+            return request.execute()
+        except Exception:
+            if attempt == LOAD_RETRIES - 1:
+                raise
+            time.sleep(0.2 * 2**attempt)
+
+
+def fetch_page(table: str, start: int, end: int, since_id: int | None = None) -> list[dict]:
+    """Fetch rows `start..end` (inclusive) of `table`, retrying transient failures."""
+    return execute_with_retries(select_rows(table, since_id).range(start, end)).data
+
+
+def page_to_frame(page: list[dict]) -> pd.DataFrame:
+    """Convert one page of row dicts into a typed, column-oriented frame.
+
+    Pages are converted as they arrive so the row dicts for the whole table
+    never have to be alive at the same time.
+    """
+    if not page:
+        return pd.DataFrame()
+    df = pd.DataFrame({name: [row[name] for row in page] for name in page[0]})
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def concat_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate page frames, unifying categorical dictionaries so the
+    categorical columns don't fall back to object dtype."""
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return pd.DataFrame()
+    for column in CATEGORICAL_COLUMNS:
+        if column in frames[0]:
+            # A page where the column is all null has empty, object-typed
+            # categories, which union_categoricals won't combine with text ones
+            for f in frames:
+                f[column] = f[column].astype("category")
+                f[column] = f[column].cat.set_categories(f[column].cat.categories.astype(str))
+            categories = union_categoricals([f[column] for f in frames]).categories
+            for f in frames:
+                f[column] = f[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def fetch_table(table: str, since_id: int | None = None) -> pd.DataFrame:
+    """Fetch every row of `table`, or only those with an id above `since_id`.
+
+    The first request asks for the exact row count, which is used to plan the
+    remaining page ranges up front so they can be fetched concurrently instead
+    of one round trip at a time. Pages are reassembled in range order. If the
+    server returns no count, pages are fetched one after another instead.
+    """
+    response = execute_with_retries(select_rows(table, since_id, count="exact"))
+    # response.data is a list of dictionaries
+    # [{'id': 1, 'total_bill': 16.99, 'tip': 1.01, 'sex': 'Female', 'smoker': 'No', 'day': 'Sun', 'time': 'Dinner', 'size': 2}, ...]
+    first_page = response.data
+    total_rows = response.count
+    frames = [page_to_frame(first_page)]
+
+    if total_rows is None:
+        # Without a count there is nothing to plan with; page through one
+        # request at a time until a short page
+        page_size, page, start = len(first_page), first_page, len(first_page)
+        while page_size and len(page) == page_size:
+            page = fetch_page(table, start, start + page_size - 1, since_id=since_id)
+            frames.append(page_to_frame(page))
+            start += len(page)
+        return concat_frames(frames)
+    if total_rows <= len(first_page):
+        return concat_frames(frames)
+
+    # The server may cap pages below our default; follow whatever it returned
+    page_size = len(first_page) or PAGE_SIZE
+    ranges = [
+        (start, start + page_size - 1)
+        for start in range(len(first_page), total_rows, page_size)
+    ]
+    del first_page, response
+    # Pages are converted on the worker threads: pages that finish ahead of
+    # their turn wait as compact frames, not as lists of row dicts
+    with ThreadPoolExecutor(max_workers=min(LOAD_WORKERS, len(ranges))) as pool:
+        frames.extend(
+            pool.map(lambda r: page_to_frame(fetch_page(table, *r, since_id=since_id)), ranges)
+        )
+    return concat_frames(frames)
+
+
+def read_snapshot(table: str) -> tuple[pd.DataFrame, dict] | None:
+    data_path = SNAPSHOT_DIR / f"{table}.parquet"
+    meta_path = SNAPSHOT_DIR / f"{table}.json"
+    if not data_path.exists() or not meta_path.exists():
+        return None
+    try:
+        return pd.read_parquet(data_path), json.loads(meta_path.read_text())
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def write_snapshot_meta(table: str, meta: dict) -> None:
+    # Write to a temp file first so concurrent readers never see a partial file
+    meta_tmp = SNAPSHOT_DIR / f"{table}.json.{os.getpid()}.tmp"
+    meta_tmp.write_text(json.dumps(meta))
+    os.replace(meta_tmp, SNAPSHOT_DIR / f"{table}.json")
+
+
+def write_snapshot(table: str, df: pd.DataFrame) -> None:
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "table": table,
+        "watermark": int(df["id"].max()) if len(df) else None,
+        "fetched_at": time.time(),
+    }
+    data_tmp = SNAPSHOT_DIR / f"{table}.parquet.{os.getpid()}.tmp"
+    df.to_parquet(data_tmp, index=False)
+    os.replace(data_tmp, SNAPSHOT_DIR / f"{table}.parquet")
+    write_snapshot_meta(table, meta)
+
+
+def normalize_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Store low-cardinality columns compactly.
+
+    Text columns listed in CATEGORICAL_COLUMNS become categoricals (which
+    DuckDB sees as ENUMs). Column names, order and values are unchanged, so
+    `query.df_to_schema` renders the same schema text.
+
+    Integer columns are stored as 64-bit (including ones read back from older,
+    downcast snapshots): as TINYINT or SMALLINT, everyday arithmetic in
+    generated SQL such as `size * 100` would overflow.
+    """
+    for column in df.columns:
+        dtype = df[column].dtype
+        if column in CATEGORICAL_COLUMNS:
+            if not isinstance(dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype("category")
+        elif pd.api.types.is_integer_dtype(dtype) and dtype.itemsize < 8:
+            df[column] = df[column].astype("int64")
+    return df
+
+
+def load_table(table: str, fallback_csv: Path | None = None) -> pd.DataFrame:
+    """Load `table`, preferring the local snapshot and fetching only new rows.
+
+    If the remote is unreachable, the stale snapshot is used; failing that,
+    `fallback_csv` (with a synthesized `id` column).
+    """
+    snapshot = read_snapshot(table)
+    if snapshot is not None:
+        df, meta = snapshot
+        if time.time() - meta["fetched_at"] < SNAPSHOT_MAX_AGE:
+            return df
+
+    try:
+        if snapshot is None:
+            df = fetch_table(table)
+        else:
+            new_rows = fetch_table(table, since_id=meta["watermark"])
+            if len(new_rows):
+                df = concat_frames([df, new_rows])
+            else:
+                # Nothing new, so the data file stays as it is; only record
+                # when the snapshot was last checked
+                meta = {**meta, "fetched_at": time.time()}
+    except Exception:
+        traceback.print_exc()
+        if snapshot is not None:
+            return df
+        if fallback_csv is None:
+            raise
+        print(f"Could not reach Supabase; loading {table} from {fallback_csv}")
+        df = pd.read_csv(
+            fallback_csv, dtype={column: "category" for column in CATEGORICAL_COLUMNS}
+        )
+        df.insert(0, "id", range(1, len(df) + 1))
+        return df
+
+    try:
+        if snapshot is not None and not len(new_rows):
+            write_snapshot_meta(table, meta)
+        else:
+            write_snapshot(table, df)
+    except Exception:
+        # Snapshots are an optimization (and need pyarrow); never fail startup over them
+        traceback.print_exc()
+    return df
+
+
+def table_schema(con: duckdb.DuckDBPyConnection, relation: str) -> list[tuple[str, str]]:
+    return con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {relation})").fetchall()
+
+
+def database_is_current(path: Path, table: str, df: pd.DataFrame) -> bool:
+    """Whether the database file at `path` already holds `df` as `table`.
+
+    Besides the row count and watermark, the column names and types must
+    match what `df` would be stored as, so a file built from an older schema
+    (e.g. before a column was added or retyped) is rebuilt.
+    """
+    if not path.exists():
+        return False
+    with duckdb.connect() as scratch:
+        scratch.register("df", df.head(0))
+        expected_schema = table_schema(scratch, "df")
+    try:
+        with duckdb.connect(str(path), read_only=True) as con:
+            rows, watermark = con.execute(f"SELECT count(*), max(id) FROM {table}").fetchone()
+            schema = table_schema(con, table)
+    except duckdb.Error:
+        return False
+    return rows == len(df) and watermark == df["id"].max() and schema == expected_schema
+
+
+def materialize_table(path: Path, table: str, df: pd.DataFrame) -> None:
+    """Write `df` into a fresh database file at `path` as a native table."""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with duckdb.connect(str(tmp)) as con:
+        con.register("df", df)
+        con.execute(f"CREATE TABLE {table} AS SELECT * FROM df")
+    os.replace(tmp, path)
+
+
+tips = normalize_schema(load_table("tips", fallback_csv=here / "tips.csv"))
 tips["percent"] = tips.tip / tips.total_bill
 
-duckdb.query("SET allow_community_extensions = false;")
-duckdb.register("tips", tips)
+# Identifies the loaded data; anything cached from query results is keyed by
+# it so a refreshed snapshot never serves results computed on older data.
+data_version = f"{len(tips)}:{tips['id'].max() if len(tips) else 0}"
+
+# All queries go through this connection (or cursors of it, see db.py). The
+# data lives in the attached database rather than in a connection-local
+# registered view, so every cursor sees it.
+con = duckdb.connect()
+con.execute("SET allow_community_extensions = false;")
+db_path = DUCKDB_PATH
+try:
+    if not database_is_current(db_path, "tips", tips):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        materialize_table(db_path, "tips", tips)
+except OSError:
+    # e.g. a read-only checkout; fall back to a file of this process's own
+    traceback.print_exc()
+    db_path = Path(tempfile.mkdtemp(prefix="tips-")) / "tips.duckdb"
+    materialize_table(db_path, "tips", tips)
+escaped_path = str(db_path).replace("'", "''")
+con.execute(f"ATTACH '{escaped_path}' AS tips_db (READ_ONLY)")
+con.execute("CREATE VIEW tips AS SELECT * FROM tips_db.tips")
@@ -3,7 +3,6 @@ from pathlib import Path
 from typing import Annotated
 
 from dotenv import load_dotenv
-import duckdb
 import faicons as fa
 import plotly.express as px
 from chatlas import ChatOpenAI, ChatGoogle
@@ -15,7 +14,7 @@ load_dotenv()
 
 import query
 from explain_plot import explain_plot
-from shared import tips  # Load data and compute static values
+from shared import con, tips  # Load data and compute static values
 
 here = Path(__file__).parent
 
@@ -191,7 +190,7 @@ def server(input, output, session):
     def tips_data():
         if current_query() == "":
             return tips
-        return duckdb.query(current_query()).df()
+        return con.query(current_query()).df()
 
     #
     # 🏷️ Header outputs --------------------------------------------------------
@@ -437,7 +436,7 @@ def server(input, output, session):
         Args:
           query: A DuckDB SQL query; must be a SELECT statement.
         """
-        return duckdb.query(query).to_df().to_json(orient="records")
+        return con.query(query).to_df().to_json(orient="records")
 
 
 app = App(app_ui, server, static_assets=here / "www")
\ No newline at end of file
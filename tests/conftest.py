@@ -0,0 +1,30 @@
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root))
+
+# shared.py loads the tips table at import. Point it at a fresh local snapshot
+# (built from tips.csv) so the tests never need to reach Supabase.
+snapshot_dir = Path(tempfile.mkdtemp(prefix="tips-snapshot-"))
+atexit.register(shutil.rmtree, snapshot_dir, ignore_errors=True)
+tips = pd.read_csv(root / "tips.csv")
+tips.insert(0, "id", range(1, len(tips) + 1))
+tips.to_parquet(snapshot_dir / "tips.parquet", index=False)
+(snapshot_dir / "tips.json").write_text(
+    json.dumps({"table": "tips", "watermark": len(tips), "fetched_at": time.time()})
+)
+
+os.environ.setdefault("NEXT_PUBLIC_SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("NEXT_PUBLIC_SUPABASE_ANON_KEY", "test")
+os.environ["TIPS_SNAPSHOT_DIR"] = str(snapshot_dir)
+os.environ["TIPS_SNAPSHOT_MAX_AGE"] = "3600"
+os.environ.pop("TIPS_DUCKDB_PATH", None)
@@ -0,0 +1,117 @@
+"""An in-process stand-in for the parts of the Supabase client shared.py uses.
+
+Rows are generated on demand (so a large fake table costs no memory until it
+is fetched), every `execute()` sleeps for `latency` seconds to simulate a
+round trip, and pages are capped at `max_rows` like PostgREST's db-max-rows.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+DAYS = ["Thur", "Fri", "Sat", "Sun"]
+SEXES = ["Female", "Male"]
+SMOKERS = ["No", "Yes"]
+TIMES = ["Dinner", "Lunch"]
+
+
+def tips_row(i: int) -> dict:
+    """A synthetic row of the tips table; `i` is its 1-based id.
+
+    Cheap arithmetic rather than a random generator, so that building pages
+    doesn't dominate the (simulated) network time.
+    """
+    total_bill = 3 + (i * 7919 % 4700) / 100
+    return {
+        "id": i,
+        "total_bill": total_bill,
+        "tip": round(total_bill * (5 + i * 104729 % 25) / 100, 2),
+        "sex": SEXES[i % 2],
+        "smoker": SMOKERS[i % 3 == 0],
+        "day": DAYS[i * 31 % 4],
+        "time": TIMES[i % 5 == 0],
+        "size": 1 + i * 13 % 6,
+    }
+
+
+@dataclass
+class Response:
+    data: list[dict]
+    count: int | None = None
+
+
+class FakeSupabase:
+    def __init__(
+        self,
+        rows: int,
+        latency: float = 0.0,
+        max_rows: int = 1000,
+        make_row: Callable[[int], dict] = tips_row,
+        return_count: bool = True,
+    ):
+        self.rows = rows
+        self.latency = latency
+        self.max_rows = max_rows
+        self.make_row = make_row
+        self.return_count = return_count
+        # Number of upcoming execute() calls that fail, to exercise retries
+        self.failures = 0
+        # Set to make every request fail, as if the remote were unreachable
+        self.unreachable = False
+        self.requests = 0
+        self.max_concurrency = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> "Query":
+        return Query(self)
+
+
+class Query:
+    def __init__(self, client: FakeSupabase):
+        self.client = client
+        self.count = None
+        self.since_id = None
+        self.bounds = None
+
+    def select(self, columns: str, count: str | None = None) -> "Query":
+        self.count = count
+        return self
+
+    def gt(self, column: str, value: int) -> "Query":
+        assert column == "id"
+        self.since_id = value
+        return self
+
+    def order(self, column: str) -> "Query":
+        assert column == "id"
+        return self
+
+    def range(self, start: int, end: int) -> "Query":
+        self.bounds = (start, end)
+        return self
+
+    def execute(self) -> Response:
+        client = self.client
+        with client._lock:
+            client.requests += 1
+            client._active += 1
+            client.max_concurrency = max(client.max_concurrency, client._active)
+            fail = client.unreachable or client.failures > 0
+            if client.failures > 0:
+                client.failures -= 1
+        try:
+            time.sleep(client.latency)
+            if fail:
+                raise ConnectionError("Simulated network failure")
+            first_id = (self.since_id or 0) + 1
+            matching = max(client.rows - first_id + 1, 0)
+            start, end = self.bounds or (0, matching - 1)
+            end = min(end, start + client.max_rows - 1, matching - 1)
+            data = [client.make_row(first_id + i) for i in range(start, end + 1)]
+            count = matching if self.count == "exact" and client.return_count else None
+            return Response(data, count)
+        finally:
+            with client._lock:
+                client._active -= 1
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import dashboard
+import db
+import shared
+
+
+def summary(sql: str) -> dict:
+    query = dashboard.summary_sql(db.query_source(sql))
+    return asyncio.run(db.pool.run(lambda cur: db.query_df(cur, query))).to_dict("records")[0]
+
+
+def test_summary_count_stays_an_integer():
+    s = summary("")
+    assert str(s["tippers"]) == str(len(shared.tips))
+    assert abs(s["average_bill"] - shared.tips.total_bill.mean()) < 1e-9
+
+
+def test_summary_of_empty_result():
+    s = summary("SELECT * FROM tips WHERE tip < 0")
+    assert s["tippers"] == 0
+
+
+@pytest.mark.parametrize("color", [None, "sex", "day"])
+def test_scatter_figure(color):
+    fig = asyncio.run(dashboard.scatter_figure(dashboard.LazyResult(""), color))
+    markers = [t for t in fig.data if t.mode == "markers"]
+    lines = [t for t in fig.data if t.mode == "lines"]
+    groups = 1 if color is None else shared.tips[color].nunique()
+    assert len(markers) == len(lines) == groups
+    assert sum(len(t.x) for t in markers) == len(shared.tips)
+    assert all(len(t.x) <= dashboard.TREND_BINS for t in lines)
+
+
+@pytest.mark.parametrize("color", [None, "sex"])
+def test_scatter_figure_of_empty_result(color):
+    fig = asyncio.run(dashboard.scatter_figure(dashboard.LazyResult("SELECT * FROM tips WHERE tip < 0"), color))
+    assert sum(len(t.x) for t in fig.data if t.x is not None) == 0
+
+
+def test_scatter_figure_samples_large_results(monkeypatch):
+    monkeypatch.setattr(dashboard, "SCATTER_MAX_POINTS", 1000)
+    fig = asyncio.run(dashboard.scatter_figure(dashboard.LazyResult(""), "day"))
+    assert sum(len(t.x) for t in fig.data if t.mode == "markers") == 1000
+
+
+def materialized(sql: str) -> dashboard.LazyResult:
+    return dashboard.LazyResult(sql, db.materialize(shared.con.cursor(), sql))
+
+
+def test_outputs_query_the_materialized_result():
+    # A stand-in table, to tell queries over it from ones re-running the SQL
+    table = db.materialize(shared.con.cursor(), "SELECT * FROM tips LIMIT 5")
+    data = dashboard.LazyResult("SELECT * FROM tips", table)
+    assert asyncio.run(data.row_count()) == 5
+    s = asyncio.run(data.query(dashboard.summary_sql(data.source)))
+    assert s.tippers.iloc[0] == 5
+    assert len(asyncio.run(data.df(["tip"]))) == 5
+
+
+def test_materialized_result_matches_query():
+    sql = "SELECT * FROM tips WHERE day = 'Sat'; -- comment"
+    data, plain = materialized(sql), dashboard.LazyResult(sql)
+    assert asyncio.run(data.row_count()) == asyncio.run(plain.row_count())
+    assert asyncio.run(data.columns()) == asyncio.run(plain.columns())
+    assert asyncio.run(data.df(["id", "tip"])).equals(asyncio.run(plain.df(["id", "tip"])))
+
+
+@pytest.mark.parametrize("materialize", [False, True])
+def test_aggregate_chart_matches_pandas_groupby(materialize):
+    chart = dashboard.AggregateChart(
+        group_by="sex", measures={"total_bill": "avg(total_bill)", "tip": "avg(tip)"}
+    )
+    # Filtered, and with some groups nulled out, which the chart leaves out
+    sql = """
+        SELECT * REPLACE (CASE WHEN id % 10 = 0 THEN NULL ELSE sex END AS sex)
+        FROM tips WHERE day IN ('Sat', 'Sun')
+    """
+    data = materialized(sql) if materialize else dashboard.LazyResult(sql)
+    grouped = asyncio.run(data.query(chart.sql(data.source)))
+
+    tips = shared.tips[shared.tips.day.isin(["Sat", "Sun"])].astype({"sex": str})
+    tips.loc[tips.id % 10 == 0, "sex"] = None
+    # What the plot computed in pandas before
+    expected = tips.groupby("sex")[["total_bill", "tip"]].mean().reset_index()
+    assert grouped.sex.astype(str).tolist() == expected.sex.tolist()
+    for column in ["total_bill", "tip"]:
+        assert grouped[column].round(9).tolist() == expected[column].round(9).tolist()
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import time
+
+import duckdb
+import pytest
+
+import db
+import shared
+
+# Takes far longer than any test timeout; only ever run to be interrupted
+SLOW_SQL = "SELECT sum(hash(a.range + b.range)) FROM range(100000) a, range(100000) b"
+
+
+def slow_query(cur):
+    return cur.execute(SLOW_SQL).fetchall()
+
+
+def count_tips(cur):
+    return cur.execute("SELECT count(*) FROM tips").fetchone()[0]
+
+
+def test_waiting_for_busy_pool_does_not_block_event_loop():
+    pool = db.CursorPool(shared.con, 2)
+
+    async def main():
+        queries = [asyncio.create_task(pool.run(slow_query, timeout=None)) for _ in range(2)]
+        while pool.metrics()["in_use"] < 2:
+            await asyncio.sleep(0.01)
+        # A dashboard query queued behind them waits off the event loop
+        waiting = asyncio.create_task(pool.run(count_tips))
+        start = time.perf_counter()
+        await asyncio.sleep(0.2)
+        slept = time.perf_counter() - start
+        assert not waiting.done()
+        for task in queries:
+            task.cancel()
+        await asyncio.gather(*queries, return_exceptions=True)
+        return await waiting, slept
+
+    rows, slept = asyncio.run(main())
+    assert rows == len(shared.tips)
+    assert slept < 1
+
+
+def test_run_times_out_and_returns_cursor():
+    pool = db.CursorPool(shared.con, 1)
+
+    async def main():
+        start = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            await pool.run(slow_query, timeout=0.3)
+        return time.perf_counter() - start
+
+    assert asyncio.run(main()) < 5
+    assert pool.metrics()["in_use"] == 0
+
+
+def test_timeout_is_enforced_while_event_loop_is_blocked():
+    pool = db.CursorPool(shared.con, 1)
+
+    async def main():
+        task = asyncio.create_task(pool.run(slow_query, timeout=0.3))
+        while pool.metrics()["in_use"] == 0:
+            await asyncio.sleep(0.01)
+        time.sleep(2)  # Blocks the loop, as a long synchronous calc would
+        # The query was interrupted (and its cursor returned) without the loop
+        assert pool.metrics()["in_use"] == 0
+        with pytest.raises(TimeoutError):
+            await task
+
+    asyncio.run(main())
+
+
+def test_timeout_does_not_count_waiting_for_a_cursor():
+    pool = db.CursorPool(shared.con, 1)
+
+    async def main():
+        busy = asyncio.create_task(pool.run(lambda cur: time.sleep(0.6), timeout=None))
+        await asyncio.sleep(0.05)
+        rows = await pool.run(count_tips, timeout=0.3)
+        await busy
+        return rows
+
+    assert asyncio.run(main()) == len(shared.tips)
+
+
+def test_cancelled_before_start_never_runs():
+    pool = db.CursorPool(shared.con, 1)
+    started = []
+
+    def record(cur):
+        started.append(True)
+        return slow_query(cur)
+
+    async def main():
+        busy = asyncio.create_task(pool.run(lambda cur: time.sleep(0.3), timeout=None))
+        await asyncio.sleep(0.05)
+        waiting = asyncio.create_task(pool.run(record, timeout=None))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        await busy
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        # Once the cursor frees up, the cancelled call must not run the query
+        await pool.run(count_tips, timeout=5)
+
+    asyncio.run(main())
+    assert started == []
+    assert pool.metrics()["in_use"] == 0
+
+
+def test_sessions_keep_streaming_during_long_query():
+    pool = db.CursorPool(shared.con, 2)
+
+    async def stream(chunks: int) -> float:
+        # Stands in for a chat response streaming to one session; returns
+        # the longest gap between chunks
+        longest, last = 0.0, time.perf_counter()
+        for _ in range(chunks):
+            await asyncio.sleep(0.01)
+            # Each chunk also re-reads the dashboard, like a reactive calc
+            await pool.run(count_tips)
+            now = time.perf_counter()
+            longest, last = max(longest, now - last), now
+        return longest
+
+    async def main():
+        query = asyncio.create_task(pool.run(slow_query, timeout=1.5))
+        gaps = await asyncio.gather(stream(100), stream(100))
+        with pytest.raises(TimeoutError):
+            await query
+        return gaps
+
+    assert max(asyncio.run(main())) < 0.5
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("SELECT  tip FROM tips;", "select tip\nfrom tips -- comment"),
+        ("SELECT 'it''s' FROM tips", "select 'it''s' /* c */ from tips ;"),
+        ('SELECT "total_bill" FROM tips', 'SELECT "total_bill" -- x\n FROM tips'),
+    ],
+)
+def test_normalize_sql_ignores_formatting(a, b):
+    assert db.normalize_sql(a) == db.normalize_sql(b)
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("SELECT $$a -- x$$", "SELECT $$a -- y$$"),
+        ("SELECT $t$a /* x */$t$", "SELECT $t$a /* y */$t$"),
+        ("SELECT E'a--b'", "SELECT E'a--c'"),
+        ("SELECT 'a--b'", "SELECT 'a--c'"),
+        ('SELECT "a--b" FROM t', 'SELECT "a--c" FROM t'),
+        ("SELECT 'A'", "SELECT 'a'"),
+    ],
+)
+def test_normalize_sql_keeps_literals_whole(a, b):
+    assert db.normalize_sql(a) != db.normalize_sql(b)
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("SELECT * FROM tips", True),
+        ("SELECT 'random' AS word FROM tips", True),
+        ("SELECT * FROM tips USING SAMPLE 10 REPEATABLE (42)", True),
+        ("SELECT random() FROM tips", False),
+        ("SELECT now()", False),
+        ("SELECT current_date", False),
+        ("SELECT * FROM tips USING SAMPLE 10", False),
+        ("SELECT * FROM tips TABLESAMPLE 10%", False),
+    ],
+)
+def test_is_deterministic(sql, expected):
+    assert db.is_deterministic(sql) is expected
+
+
+def test_nondeterministic_queries_are_not_cached():
+    cache = db.ResultCache(1024**2)
+    cur = shared.con.cursor()
+    for _ in range(2):
+        cache.get_or_compute("SELECT random() AS r", lambda: cur.query("SELECT random() AS r").df())
+    assert cache.metrics()["entries"] == 0
+    for _ in range(2):
+        cache.get_or_compute("SELECT 1 AS one", lambda: cur.query("SELECT 1 AS one").df())
+    assert cache.metrics() | {"bytes": 0} == {"entries": 1, "bytes": 0, "hits": 1, "misses": 1}
+
+
+@pytest.mark.parametrize("rows", [1, 10, 50, 51, 1_000, 100_000, 1_000_000])
+def test_shape_result_is_bounded(rows):
+    df = shared.con.query(
+        f"SELECT range AS id, range * 0.5 AS amount, 'day ' || (range % 7) AS day FROM range({rows})"
+    ).df()
+    text = db.shape_result(df)
+    assert len(text) <= db.RESULT_MAX_BYTES
+    result = json.loads(text)
+    if rows <= db.RESULT_MAX_ROWS:
+        assert len(result) == rows
+    else:
+        assert result["truncated"] and result["row_count"] == rows
+        assert f"{rows} rows, too many" in result["note"]
+        assert 0 < len(result["first_rows"]) <= db.RESULT_MAX_ROWS
+
+
+def test_shape_result_note_for_wide_rows():
+    df = shared.con.query("SELECT day, list(tip) AS tips FROM tips GROUP BY day").df()
+    result = json.loads(db.shape_result(df))
+    assert result["truncated"]
+    assert "too large" in result["note"]
+    assert "too many" not in result["note"]
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        # Both pass EXPLAIN, but fail when run
+        "SELECT * FROM tips WHERE CAST(day AS VARCHAR)::INTEGER > 1",
+        "SELECT size::TINYINT * 100 AS x FROM tips",
+    ],
+)
+def test_materialize_surfaces_runtime_errors(sql):
+    db.check_query(shared.con, sql)
+    with pytest.raises(duckdb.Error):
+        db.materialize(shared.con.cursor(), sql)
+
+
+def test_materialize_is_cached_by_normalized_sql():
+    cur = shared.con.cursor()
+    table = db.materialize(cur, "SELECT * FROM tips WHERE day = 'Sun'")
+    assert table.num_rows == (shared.tips.day == "Sun").sum()
+    hits = db.dashboard_results.metrics()["hits"]
+    assert db.materialize(cur, "select *  from tips where day = 'Sun';") is table
+    assert db.dashboard_results.metrics()["hits"] == hits + 1
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "DELETE FROM tips WHERE sex = 'Male'",
+        "DROP VIEW tips",
+        "CREATE TABLE copy AS SELECT * FROM tips",
+        "SELECT 1; DELETE FROM tips",
+        "EXPLAIN SELECT * FROM tips",
+    ],
+)
+def test_query_df_only_runs_select(sql):
+    with pytest.raises(ValueError, match="SELECT"):
+        asyncio.run(db.pool.run(lambda cur: db.query_df(cur, sql)))
+    assert shared.con.execute("SELECT count(*) FROM tips").fetchone()[0] == len(shared.tips)
+
+
+@pytest.mark.parametrize("sql", ["FROM tips LIMIT 1", "WITH t AS (SELECT 1 AS x) SELECT * FROM t", "SELECT 1;"])
+def test_query_df_runs_select_forms(sql):
+    assert len(asyncio.run(db.pool.run(lambda cur: db.query_df(cur, sql)))) == 1
+
+
+def test_tips_is_read_only():
+    cur = shared.con.cursor()
+    for sql in ["DELETE FROM tips", "DELETE FROM tips_db.tips", "UPDATE tips_db.tips SET tip = 0"]:
+        with pytest.raises(duckdb.Error):
+            cur.execute(sql)
+    assert cur.execute("SELECT count(*) FROM tips").fetchone()[0] == len(shared.tips)
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import chatlas
+import plotly.graph_objects as go
+from chatlas.types import ContentText
+
+import explain_plot
+
+
+def test_import_does_not_start_render_pool():
+    # A fresh interpreter, so earlier tests' pools don't count
+    code = "import explain_plot, multiprocessing; assert not multiprocessing.active_children()"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(explain_plot.__file__).parent, check=True)
+
+
+def test_broken_render_pool_is_replaced():
+    pool = explain_plot.render_pool()
+    try:
+        # Kill a worker, which breaks the whole pool
+        pool.submit(os._exit, 1)
+        deadline = time.monotonic() + 30
+        while not pool._broken and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        async def render():
+            try:
+                await explain_plot.render_plot(go.Figure().to_json(), explain_plot.MODEL_IMAGE)
+            except Exception as e:
+                # Rendering itself may fail here (Kaleido needs Chrome); only
+                # a broken pool is a problem
+                return e
+
+        error = asyncio.run(render())
+        assert not isinstance(error, explain_plot.BrokenProcessPool)
+        assert explain_plot.render_pool() is not pool
+    finally:
+        explain_plot.discard_render_pool(explain_plot.render_pool())
+
+
+# Stand-ins for Kaleido (which needs Chrome) in the render pool's workers
+def quick_render(fig_json: str, options: dict) -> bytes:
+    return b""
+
+
+def slow_render(fig_json: str, options: dict) -> bytes:
+    time.sleep(1)
+    return b"image"
+
+
+def test_event_loop_keeps_running_during_render():
+    async def ticker(stop: asyncio.Event) -> float:
+        # Returns the longest gap between ticks
+        longest, last = 0.0, time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(0.02)
+            now = time.perf_counter()
+            longest, last = max(longest, now - last), now
+        return longest
+
+    async def main():
+        # Warm the pool first, so the render itself is what's measured
+        await explain_plot.render_plot("{}", {}, render=quick_render)
+        stop = asyncio.Event()
+        ticks = asyncio.create_task(ticker(stop))
+        start = time.perf_counter()
+        image = await explain_plot.render_plot(go.Figure().to_json(), explain_plot.MODEL_IMAGE, render=slow_render)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        return image, elapsed, await ticks
+
+    try:
+        image, elapsed, longest_gap = asyncio.run(main())
+    finally:
+        explain_plot.discard_render_pool(explain_plot.render_pool())
+    assert image == b"image"
+    assert elapsed >= 1
+    assert longest_gap < 0.5
+
+
+def chat_with(*messages: str) -> chatlas.Chat:
+    chat = chatlas.ChatOpenAI(api_key="test", model="gpt-4o-mini", system_prompt="Dashboard")
+    turns = []
+    for i, message in enumerate(messages):
+        turns.append(chatlas.UserTurn([ContentText(text=message)]))
+        turns.append(chatlas.AssistantTurn([ContentText(text=f"reply {i}")]))
+    chat.set_turns(turns)
+    return chat
+
+
+def explanation() -> list:
+    return [
+        chatlas.UserTurn([ContentText(text=explain_plot.INSTRUCTIONS)]),
+        chatlas.AssistantTurn([ContentText(text="Tips grow with the bill.")]),
+    ]
+
+
+def test_images_are_shared_but_explanations_are_per_conversation():
+    cache = explain_plot.PlotCache(max_bytes=1024**2)
+    fig_json = go.Figure(go.Scatter(x=[1, 2], y=[3, 4])).to_json()
+    key = cache.key(fig_json, "gpt-4o-mini")
+
+    alice = chat_with("My salary is private; filter to tips over $5")
+    assert cache.get(key) is None
+    cache.put(key, b"png", "data:image/jpeg;base64,")
+    cache.set_explanation(key, cache.context_key(alice), explanation())
+
+    # Another session gets the rendered images...
+    bob = chat_with("Show me smokers")
+    assert cache.get(key)["display_img"] == b"png"
+    # ...but not an explanation given in someone else's conversation
+    assert cache.get_explanation(key, cache.context_key(bob)) is None
+    # The same conversation does get it back
+    assert cache.get_explanation(key, cache.context_key(alice)) == explanation()
+    # And so does one whose context is identical
+    assert cache.get_explanation(key, cache.context_key(chat_with(
+        "My salary is private; filter to tips over $5"
+    ))) == explanation()
+    # Once the conversation moves on, it no longer matches
+    assert cache.get_explanation(key, cache.context_key(chat_with(
+        "My salary is private; filter to tips over $5", "Now only Sundays"
+    ))) is None
+
+    assert cache.metrics() | {"bytes": 0} == {
+        "entries": 1, "bytes": 0, "hits": 1, "misses": 1, "explanation_hits": 2
+    }
+
+
+def test_changed_plot_or_model_misses():
+    cache = explain_plot.PlotCache(max_bytes=1024**2)
+    before = go.Figure(go.Scatter(x=[1, 2], y=[3, 4])).to_json()
+    after = go.Figure(go.Scatter(x=[1, 2], y=[3, 5])).to_json()
+    cache.put(cache.key(before, "gpt-4o-mini"), b"png", "url")
+    assert cache.get(cache.key(after, "gpt-4o-mini")) is None
+    assert cache.get(cache.key(before, "gpt-4o")) is None
+    assert cache.get(cache.key(before, "gpt-4o-mini")) is not None
+    assert cache.metrics()["hits"] == 1 and cache.metrics()["misses"] == 2
+
+
+def test_evicts_least_recently_used():
+    cache = explain_plot.PlotCache(max_bytes=250)
+    for name in "abc":
+        cache.put(name, b"x" * 100, "")
+        if name == "b":
+            cache.get("a")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
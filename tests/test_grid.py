@@ -0,0 +1,34 @@
+import db
+import grid
+import shared
+
+
+def run(sql):
+    return shared.con.query(sql).df()
+
+
+def test_page_sql_sorts_and_pages():
+    sql = grid.page_sql("tips", 1, 10, sort_by="tip", descending=True, columns=list(shared.tips.columns))
+    df = run(sql)
+    expected = shared.tips.tip.sort_values(ascending=False).iloc[10:20].tolist()
+    assert df.tip.tolist() == expected
+
+
+def test_page_sql_ignores_column_missing_from_result():
+    query = "SELECT day, avg(tip) AS average_tip FROM tips GROUP BY day"
+    columns = list(run(f"SELECT * FROM ({query}) LIMIT 0").columns)
+    # "tip" was a valid choice for the previous query, but not for this one
+    df = run(grid.page_sql(db.query_source(query), 0, 10, sort_by="tip", columns=columns))
+    assert len(df) == 4
+    df = run(grid.page_sql(db.query_source(query), 0, 10, sort_by="average_tip", columns=columns))
+    assert df.average_tip.is_monotonic_increasing
+
+
+def test_sorted_pages_cover_every_row_once():
+    # Half the rows tie on sex, so the tiebreaker decides the order
+    columns = list(shared.tips.columns)
+    pages = [run(grid.page_sql("tips", page, 100, sort_by="sex", columns=columns)) for page in range(100)]
+    assert list(pages[0].columns) == columns
+    ids = [i for df in pages for i in df.id]
+    assert sorted(ids) == shared.tips.id.sort_values().tolist()
+    assert [s for df in pages for s in df.sex] == shared.tips.sex.sort_values().tolist()
@@ -0,0 +1,68 @@
+from chatlas import AssistantTurn, UserTurn
+from chatlas.types import ContentText, ContentToolRequest, ContentToolResult
+
+import history
+
+
+def exchange(i: int, tool: str = "query_db") -> list:
+    request = ContentToolRequest(id=f"call-{i}", name=tool, arguments={"query": f"SELECT {i}"})
+    return [
+        UserTurn([ContentText(text=f"question {i} " * 10)]),
+        AssistantTurn([request]),
+        UserTurn([ContentToolResult(value="x" * 20_000, request=request)]),
+        AssistantTurn([ContentText(text=f"answer {i} " * 30)]),
+    ]
+
+
+def conversation(exchanges: int, dashboard_at: int | None = None) -> list:
+    turns = []
+    for i in range(exchanges):
+        turns.extend(exchange(i, "update_dashboard" if i == dashboard_at else "query_db"))
+    return turns
+
+
+def tokens(turns) -> int:
+    return sum(history.estimate_tokens(t) for t in turns)
+
+
+def test_small_history_is_unchanged():
+    turns = conversation(2)
+    assert history.compact_turns(turns, budget=100_000) is turns
+
+
+def test_200_turns_stay_within_budget():
+    turns = conversation(50, dashboard_at=3)  # 200 turns
+    assert len(turns) == 200
+    budget = 15_000
+    compacted = history.compact_turns(turns, budget)
+    assert tokens(compacted) <= budget
+    # The latest exchange is kept verbatim
+    assert compacted[-4:] == turns[-4:]
+    # So is the one that last updated the dashboard
+    requests = [c for t in compacted for c in t.contents if isinstance(c, ContentToolRequest)]
+    assert "update_dashboard" in [r.name for r in requests]
+    # The input isn't modified
+    assert all(
+        c.value != history.OMITTED_RESULT
+        for t in turns
+        for c in t.contents
+        if isinstance(c, ContentToolResult)
+    )
+
+
+def test_old_tool_results_are_omitted_first():
+    turns = conversation(10)
+    budget = tokens(turns) // 2
+    compacted = history.compact_turns(turns, budget)
+    # Dropping large results was enough; every exchange is still there
+    assert len(compacted) == len(turns)
+    results = [c.value for t in compacted for c in t.contents if isinstance(c, ContentToolResult)]
+    assert results[0] == history.OMITTED_RESULT
+    assert results[-1] == "x" * 20_000
+
+
+def test_size_stays_bounded_as_conversation_grows():
+    turns = []
+    for i in range(50):
+        turns = history.compact_turns(turns + exchange(i), 15_000)
+        assert tokens(turns) <= 15_000
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import query
+import shared
+
+
+def test_normalize_schema_keeps_schema_text():
+    raw = pd.read_csv(shared.here / "tips.csv")
+    raw.insert(0, "id", range(1, len(raw) + 1))
+    normalized = shared.normalize_schema(raw.copy())
+    assert query.df_to_schema(normalized, "tips", 10) == query.df_to_schema(raw, "tips", 10)
+
+
+def test_integer_columns_are_not_narrowed():
+    types = dict(shared.con.execute("SELECT column_name, column_type FROM (DESCRIBE tips)").fetchall())
+    assert types["size"] == "BIGINT"
+    assert types["id"] == "BIGINT"
+    # Would overflow a TINYINT / SMALLINT
+    shared.con.execute("SELECT max(size * 100), max(size + 127), max(id * 10) FROM tips").fetchall()
+
+
+def test_normalize_schema_widens_downcast_snapshots():
+    df = pd.DataFrame({"id": pd.Series([1, 2], dtype="int16"), "size": pd.Series([2, 3], dtype="int8")})
+    df = shared.normalize_schema(df)
+    assert df.dtypes.tolist() == ["int64", "int64"]
+
+
+def text_column(distinct: int, rows: int = 1000, nulls: bool = False) -> pd.Series:
+    values = [f"v{i % distinct}" for i in range(rows)]
+    if nulls:
+        values[::7] = [None] * len(values[::7])
+    return pd.Series(values)
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+@pytest.mark.parametrize("distinct, exceeded", [(9, False), (10, False), (11, True)])
+def test_distinct_values_threshold(distinct, exceeded, categorical):
+    values = text_column(distinct)
+    if categorical:
+        values = values.astype("category")
+    uniques, over = query.distinct_values(values, 10)
+    assert over is exceeded
+    if not exceeded:
+        assert uniques == [f"v{i}" for i in range(distinct)]
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_distinct_values_nulls_do_not_count(categorical):
+    values = text_column(10, nulls=True)
+    if categorical:
+        values = values.astype("category")
+    uniques, exceeded = query.distinct_values(values, 10)
+    assert not exceeded
+    assert len(uniques) == 11 and sum(pd.isna(u) for u in uniques) == 1
+
+
+def test_distinct_values_late_value_past_threshold():
+    # The 11th value only appears after several chunks
+    rows = 3 * query.DISTINCT_CHUNK_SIZE
+    values = text_column(10, rows=rows)
+    values.iloc[-1] = "late"
+    assert query.distinct_values(values, 10)[1] is True
+    schema = query.df_to_schema(pd.DataFrame({"col": values}), "t", 10)
+    assert "Categorical values" not in schema
+
+
+def test_schema_lists_categories_up_to_threshold():
+    df = pd.DataFrame({"ten": text_column(10), "eleven": text_column(11)})
+    schema = query.df_to_schema(df, "t", 10).splitlines()
+    assert schema[2:4] == [
+        "- ten (TEXT)",
+        "  Categorical values: " + ", ".join(f"'v{i}'" for i in range(10)),
+    ]
+    assert schema[4:] == ["- eleven (TEXT)"]
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        pd.Series([3, 1, 5]),
+        pd.Series([1.5, np.nan, -2.0]),
+        pd.Series([np.nan, np.nan]),
+        pd.Series([], dtype="float64"),
+        pd.Series([], dtype="int64"),
+        pd.Series([1, None, 4], dtype="Int64"),
+    ],
+)
+def test_value_range_matches_pandas(values):
+    # Compared as text, since that's how the range reaches the prompt (and NaN != NaN)
+    assert str(query.value_range(values)) == str((values.min(), values.max()))
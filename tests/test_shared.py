@@ -0,0 +1,205 @@
+import json
+import time
+
+import pandas as pd
+import pytest
+
+import shared
+from fake_supabase import FakeSupabase, tips_row
+
+
+def test_tips_loaded_from_snapshot():
+    rows = len(pd.read_csv(shared.here / "tips.csv"))
+    assert len(shared.tips) == rows
+    assert shared.con.execute("SELECT count(*) FROM tips").fetchone()[0] == rows
+
+
+def test_concat_frames_with_all_null_categorical_page():
+    first = shared.page_to_frame(
+        [{"id": 1, "sex": "Male", "day": "Sun"}, {"id": 2, "sex": "Female", "day": "Sat"}]
+    )
+    nulls = shared.page_to_frame([{"id": 3, "sex": None, "day": "Sun"}])
+    df = shared.concat_frames([first, nulls])
+    assert isinstance(df.sex.dtype, pd.CategoricalDtype)
+    assert df.sex.tolist()[:2] == ["Male", "Female"]
+    assert pd.isna(df.sex.iloc[2])
+    assert sorted(df.sex.cat.categories) == ["Female", "Male"]
+
+
+def test_concat_frames_with_snapshot_and_new_rows():
+    snapshot = shared.normalize_schema(shared.tips.head(3).copy())
+    new_rows = shared.page_to_frame(
+        [{"id": 1000, "sex": None, "smoker": "No", "day": "Fri", "time": None}]
+    )
+    df = shared.concat_frames([snapshot, new_rows])
+    assert len(df) == 4
+    assert df.id.tolist()[-1] == 1000
+    assert df.day.iloc[-1] == "Fri"
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    def install(rows: int, **kwargs) -> FakeSupabase:
+        client = FakeSupabase(rows, **kwargs)
+        monkeypatch.setattr(shared, "supabase", client)
+        return client
+
+    return install
+
+
+@pytest.mark.parametrize("rows", [0, 1, 999, 1000, 1001, 5500])
+def test_fetch_table_returns_rows_in_order(fake_supabase, rows):
+    fake_supabase(rows)
+    df = shared.fetch_table("tips")
+    assert df.get("id", pd.Series(dtype=int)).tolist() == list(range(1, rows + 1))
+    if rows:
+        assert df.iloc[-1].to_dict() == tips_row(rows)
+        assert isinstance(df.day.dtype, pd.CategoricalDtype)
+
+
+def test_fetch_table_fetches_pages_concurrently(fake_supabase):
+    client = fake_supabase(10_000, latency=0.02)
+    df = shared.fetch_table("tips")
+    assert df.id.tolist() == list(range(1, 10_001))
+    assert client.requests == 10
+    assert client.max_concurrency > 1
+
+
+def test_fetch_table_follows_server_page_cap(fake_supabase):
+    # The server returns shorter pages than PAGE_SIZE asks for
+    client = fake_supabase(2_600, max_rows=250)
+    assert shared.fetch_table("tips").id.tolist() == list(range(1, 2_601))
+    assert client.requests == 11
+
+
+def test_fetch_table_without_count(fake_supabase):
+    client = fake_supabase(2_500, return_count=False)
+    assert shared.fetch_table("tips").id.tolist() == list(range(1, 2_501))
+    assert client.requests == 3
+
+
+def test_fetch_table_since_id(fake_supabase):
+    fake_supabase(3_000)
+    assert shared.fetch_table("tips", since_id=1_500).id.tolist() == list(range(1_501, 3_001))
+    assert len(shared.fetch_table("tips", since_id=3_000)) == 0
+
+
+def test_fetch_table_retries_transient_failures(fake_supabase):
+    client = fake_supabase(2_500)
+    # Fails the first request (the one with the count) once
+    client.failures = 1
+    assert shared.fetch_table("tips").id.tolist() == list(range(1, 2_501))
+
+
+def test_fetch_table_gives_up_after_retries(fake_supabase):
+    client = fake_supabase(2_500)
+    client.unreachable = True
+    with pytest.raises(ConnectionError):
+        shared.fetch_table("tips")
+    assert client.requests == shared.LOAD_RETRIES
+
+
+@pytest.fixture
+def snapshot_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(shared, "SNAPSHOT_DIR", tmp_path)
+    return tmp_path
+
+
+def age_snapshot(snapshot_dir, seconds: float) -> None:
+    meta_path = snapshot_dir / "tips.json"
+    meta = json.loads(meta_path.read_text())
+    meta["fetched_at"] -= seconds
+    meta_path.write_text(json.dumps(meta))
+
+
+def test_load_table_writes_snapshot(fake_supabase, snapshot_dir):
+    fake_supabase(1_500)
+    df = shared.load_table("tips")
+    assert df.id.tolist() == list(range(1, 1_501))
+    meta = json.loads((snapshot_dir / "tips.json").read_text())
+    assert meta["watermark"] == 1_500
+    assert pd.read_parquet(snapshot_dir / "tips.parquet").id.tolist() == df.id.tolist()
+
+
+def test_load_table_uses_fresh_snapshot_without_fetching(fake_supabase, snapshot_dir, monkeypatch):
+    fake_supabase(1_500)
+    shared.load_table("tips")
+    client = fake_supabase(2_000)
+    monkeypatch.setattr(shared, "SNAPSHOT_MAX_AGE", 300)
+    assert len(shared.load_table("tips")) == 1_500
+    assert client.requests == 0
+
+
+def test_load_table_tops_up_stale_snapshot(fake_supabase, snapshot_dir, monkeypatch):
+    fake_supabase(1_500)
+    shared.load_table("tips")
+    age_snapshot(snapshot_dir, 600)
+    monkeypatch.setattr(shared, "SNAPSHOT_MAX_AGE", 300)
+    client = fake_supabase(2_200)
+    df = shared.load_table("tips")
+    assert df.id.tolist() == list(range(1, 2_201))
+    # Only the rows past the watermark were fetched
+    assert client.requests == 1
+    assert json.loads((snapshot_dir / "tips.json").read_text())["watermark"] == 2_200
+    assert len(pd.read_parquet(snapshot_dir / "tips.parquet")) == 2_200
+
+
+def test_load_table_without_new_rows_only_updates_metadata(fake_supabase, snapshot_dir, monkeypatch):
+    fake_supabase(1_500)
+    shared.load_table("tips")
+    age_snapshot(snapshot_dir, 600)
+    data_mtime = (snapshot_dir / "tips.parquet").stat().st_mtime_ns
+    monkeypatch.setattr(shared, "SNAPSHOT_MAX_AGE", 0)
+    assert len(shared.load_table("tips")) == 1_500
+    assert (snapshot_dir / "tips.parquet").stat().st_mtime_ns == data_mtime
+    meta = json.loads((snapshot_dir / "tips.json").read_text())
+    assert time.time() - meta["fetched_at"] < 60
+    assert meta["watermark"] == 1_500
+
+
+def test_load_table_falls_back_to_stale_snapshot(fake_supabase, snapshot_dir, monkeypatch):
+    fake_supabase(1_500)
+    shared.load_table("tips")
+    monkeypatch.setattr(shared, "SNAPSHOT_MAX_AGE", 0)
+    fake_supabase(2_000).unreachable = True
+    assert shared.load_table("tips", fallback_csv=shared.here / "tips.csv").id.tolist() == list(
+        range(1, 1_501)
+    )
+
+
+def test_load_table_falls_back_to_csv(fake_supabase, snapshot_dir):
+    fake_supabase(1_500).unreachable = True
+    df = shared.load_table("tips", fallback_csv=shared.here / "tips.csv")
+    csv = pd.read_csv(shared.here / "tips.csv")
+    assert len(df) == len(csv)
+    assert df.id.tolist() == list(range(1, len(csv) + 1))
+    assert isinstance(df.sex.dtype, pd.CategoricalDtype)
+    # Nothing was written, so the next start tries the remote again
+    assert not (snapshot_dir / "tips.parquet").exists()
+
+
+def test_load_table_unreachable_without_fallback(fake_supabase, snapshot_dir):
+    fake_supabase(1_500).unreachable = True
+    with pytest.raises(ConnectionError):
+        shared.load_table("tips")
+
+
+def test_database_is_current(tmp_path):
+    path = tmp_path / "tips.duckdb"
+    df = shared.tips.head(100).copy()
+    assert not shared.database_is_current(path, "tips", df)
+    shared.materialize_table(path, "tips", df)
+    assert shared.database_is_current(path, "tips", df)
+    # New rows
+    assert not shared.database_is_current(path, "tips", shared.tips.head(101))
+
+
+def test_database_with_old_schema_is_rebuilt(tmp_path):
+    path = tmp_path / "tips.duckdb"
+    df = shared.tips.head(100).copy()
+    # Built while integer columns were downcast
+    shared.materialize_table(path, "tips", df.astype({"size": "int8", "id": "int16"}))
+    assert not shared.database_is_current(path, "tips", df)
+    # Built before a column was added
+    shared.materialize_table(path, "tips", df.drop(columns="percent"))
+    assert not shared.database_is_current(path, "tips", df)